@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+"""An asyncio client for the API of the Brad Spengler fork of Cuckoo. Requires aiohttp - https://aiohttp.org"""
+
+"""Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+from asyncio import Semaphore
+from io import BytesIO
+
+from aiohttp import BasicAuth, ClientSession, FormData, TCPConnector
+
+from cuckooutils import _new_hashers, get_hash_type
+
+
+class AsyncCuckoo(object):
+    @staticmethod
+    async def raise_errors(response):
+        response.raise_for_status()
+        if response.headers.get("content-type", "").lower().startswith("application/json"):
+            results = await response.json(content_type=None)
+            if results["error"]:
+                raise RuntimeError(results["error_value"])
+
+    def __init__(self, cuckoo_root, username=None, password=None, verify=True, proxy=None,
+                 max_concurrency=100, keepalive_timeout=30):
+        self.root = cuckoo_root
+        self.api_root = "{0}/api".format(self.root)
+        self.username = username
+        self.password = password
+        self.verify = verify
+        self.proxy = proxy
+        self.max_concurrency = max_concurrency
+        self.keepalive_timeout = keepalive_timeout
+        self.auth = None
+        if username or password:
+            self.auth = BasicAuth(self.username or "", self.password or "")
+        self._semaphore = Semaphore(max_concurrency)
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self.max_concurrency, keepalive_timeout=self.keepalive_timeout,
+                                     ssl=None if self.verify else False)
+            self._session = ClientSession(connector=connector, auth=self.auth)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _request(self, method, url, result="json", **kwargs):
+        async with self._semaphore:
+            async with self.session.request(method, url, proxy=self.proxy, **kwargs) as response:
+                await self.raise_errors(response)
+                if result == "json":
+                    return await response.json(content_type=None)
+                return await response.read()
+
+    async def submit_file(self, file_name, file_to_upload, tags=None, options=None):
+        if tags is None:
+            tags = ""
+        if options is None:
+            options = ""
+
+        url = "{0}{1}".format(self.api_root, "/tasks/create/file/")
+        data = FormData(dict(tags=tags, options=options))
+        data.add_field("file", file_to_upload, filename=file_name)
+        response = await self._request("POST", url, data=data)
+        return response["data"]["task_ids"]
+
+    async def submit_url(self, url, tags=None, options=None):
+        if tags is None:
+            tags = ""
+        if options is None:
+            options = "procmemdump=yes"
+        else:
+            options = "process_memory=yes,{0}".format(options)
+
+        api_url = "{0}{1}".format(self.api_root, "/tasks/create/url/")
+        data = dict(url=url, tags=tags, options=options)
+        response = await self._request("POST", api_url, data=data)
+        return response["data"]["task_ids"]
+
+    async def submit_vtdl(self, file_hash, tags=None, options=None):
+        if tags is None:
+            tags = ""
+        if options is None:
+            options = "procmemdump=yes"
+        else:
+            options = "process_memory=yes,{0}".format(options)
+
+        api_url = "{0}{1}".format(self.api_root, "/tasks/create/vtdl/")
+        data = dict(vtdl=file_hash, tags=tags, options=options)
+        response = await self._request("POST", api_url, data=data)
+        return response["data"]['task_ids']
+
+    async def find_tasks(self, sample_hash):
+        hash_type = get_hash_type(sample_hash)
+        results = await self._request("GET", "{0}/tasks/search/{1}/{2}".format(self.api_root, hash_type,
+                                                                               sample_hash))
+        results = results['data']
+        if len(results) > 0:
+            results = list(map(lambda x: x['id'], results))
+
+        return results
+
+    async def extended_search(self, options):
+        results = await self._request("POST", "{0}/tasks/extendedsearch/".format(self.api_root), data=options)
+        return results['data']
+
+    async def list_tasks(self, limit=None, offset=None, window=None):
+        url = "{0}/tasks/list/".format(self.api_root)
+        if limit:
+            url += "{0}/".format(limit)
+            if offset or window:
+                url += "{0}/".format(offset or 0)
+                if window:
+                    url += "{0}/".format(window)
+
+        return await self._request("GET", url)
+
+    async def view_task(self, task_id):
+        results = await self._request("GET", "{0}/tasks/view/{1}".format(self.api_root, task_id))
+        return results['data']
+
+    async def reschedule_task(self, task_id):
+        results = await self._request("GET", "{0}/tasks/reschedule/{1}".format(self.api_root, task_id))
+        return results['data']
+
+    async def delete_task(self, task_id):
+        results = await self._request("GET", "{0}/tasks/delete/{1}".format(self.api_root, task_id))
+        return results['data']
+
+    async def get_task_status(self, task_id):
+        results = await self._request("GET", "{0}/tasks/status/{1}".format(self.api_root, task_id))
+        status = results['data']
+        # Workaround the difference in status names in web API and UI
+        if status == "completed":
+            status = "processing"
+
+        return status
+
+    async def get_task_report(self, task_id, report_format="json"):
+        url = "{0}/tasks/get/report/{1}/{2}".format(self.api_root, task_id, report_format)
+        if report_format == "json":
+            results = await self._request("GET", url)
+            results = results['data']
+        elif report_format == "pdf":
+            results = BytesIO(await self._request("GET", url, result="bytes"))
+        else:
+            results = await self._request("GET", url, result="bytes")
+
+        return results
+
+    async def get_task_iocs(self, task_id, detailed=False):
+        url = "{0}/tasks/get/iocs/{1}".format(self.api_root, task_id)
+        if detailed:
+            url += "/detailed/"
+        results = await self._request("GET", url)
+        return results['data']
+
+    async def get_task_screenshots(self, task_id, screenshot_id=None):
+        url = "{0}/tasks/get/screenshot/{1}/".format(self.api_root, task_id)
+        if screenshot_id:
+            url += "{0}/".format(screenshot_id)
+        return BytesIO(await self._request("GET", url, result="bytes"))
+
+    def _task_artifact_url(self, artifact, task_id, item_id=None):
+        url = "{0}/tasks/get/{1}/{2}/".format(self.api_root, artifact, task_id)
+        if item_id:
+            url += "{0}/".format(item_id)
+        return url
+
+    async def _iter_artifact(self, url, chunk_size=65536):
+        # Memory dumps can be several GB, so artifacts are streamed, and only small JSON responses are checked for
+        # errors
+        async with self._semaphore:
+            async with self.session.get(url, proxy=self.proxy) as response:
+                response.raise_for_status()
+                if (response.headers.get("content-type", "").lower().startswith("application/json") and
+                        response.content_length is not None and response.content_length <= 65536):
+                    await self.raise_errors(response)
+                    yield await response.read()
+                    return
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+
+    async def _download_artifact(self, url, file_path, hashes=None, chunk_size=65536):
+        hashers = _new_hashers(hashes)
+        size = 0
+        with open(file_path, "wb") as output_file:
+            async for chunk in self._iter_artifact(url, chunk_size=chunk_size):
+                output_file.write(chunk)
+                size += len(chunk)
+                for hasher in hashers.values():
+                    hasher.update(chunk)
+
+        return dict(path=file_path, size=size,
+                    hashes=dict((hash_type, hashers[hash_type].hexdigest()) for hash_type in hashers))
+
+    async def get_task_procmemory(self, task_id, pid=None):
+        url = self._task_artifact_url("procmemory", task_id, pid)
+        return BytesIO(await self._request("GET", url, result="bytes"))
+
+    def iter_task_procmemory(self, task_id, pid=None, chunk_size=65536):
+        return self._iter_artifact(self._task_artifact_url("procmemory", task_id, pid), chunk_size=chunk_size)
+
+    async def download_task_procmemory(self, task_id, file_path, pid=None, hashes=None):
+        return await self._download_artifact(self._task_artifact_url("procmemory", task_id, pid), file_path,
+                                             hashes=hashes)
+
+    async def get_task_fullmemory(self, task_id):
+        url = self._task_artifact_url("fullmemory", task_id)
+        return BytesIO(await self._request("GET", url, result="bytes"))
+
+    def iter_task_fullmemory(self, task_id, chunk_size=65536):
+        return self._iter_artifact(self._task_artifact_url("fullmemory", task_id), chunk_size=chunk_size)
+
+    async def download_task_fullmemory(self, task_id, file_path, hashes=None):
+        return await self._download_artifact(self._task_artifact_url("fullmemory", task_id), file_path,
+                                             hashes=hashes)
+
+    async def get_task_pcap(self, task_id):
+        url = self._task_artifact_url("pcap", task_id)
+        return BytesIO(await self._request("GET", url, result="bytes"))
+
+    def iter_task_pcap(self, task_id, chunk_size=65536):
+        return self._iter_artifact(self._task_artifact_url("pcap", task_id), chunk_size=chunk_size)
+
+    async def download_task_pcap(self, task_id, file_path, hashes=None):
+        return await self._download_artifact(self._task_artifact_url("pcap", task_id), file_path, hashes=hashes)
+
+    async def get_task_dropped_files(self, task_id):
+        url = self._task_artifact_url("dropped", task_id)
+        return BytesIO(await self._request("GET", url, result="bytes"))
+
+    def iter_task_dropped_files(self, task_id, chunk_size=65536):
+        return self._iter_artifact(self._task_artifact_url("dropped", task_id), chunk_size=chunk_size)
+
+    async def download_task_dropped_files(self, task_id, file_path, hashes=None):
+        return await self._download_artifact(self._task_artifact_url("dropped", task_id), file_path, hashes=hashes)
+
+    async def get_task_suri_files(self, task_id):
+        url = self._task_artifact_url("surifile", task_id)
+        return BytesIO(await self._request("GET", url, result="bytes"))
+
+    def iter_task_suri_files(self, task_id, chunk_size=65536):
+        return self._iter_artifact(self._task_artifact_url("surifile", task_id), chunk_size=chunk_size)
+
+    async def download_task_suri_files(self, task_id, file_path, hashes=None):
+        return await self._download_artifact(self._task_artifact_url("surifile", task_id), file_path, hashes=hashes)
+
+    async def view_file(self, file_hash):
+        hash_type = get_hash_type(file_hash)
+        results = await self._request("GET", "{0}/files/view/{1}/{2}/".format(self.api_root, hash_type, file_hash))
+        return results['data']
+
+    async def get_file(self, file_hash):
+        hash_type = get_hash_type(file_hash)
+        url = "{0}/files/get/{1}/{2}/".format(self.api_root, hash_type, file_hash)
+        return BytesIO(await self._request("GET", url, result="bytes"))
+
+    async def list_machines(self):
+        results = await self._request("GET", "{0}/machines/list/".format(self.api_root))
+        return results['data']
+
+    async def view_machine(self, machine_name):
+        results = await self._request("GET", "{0}/machines/view/{1}/".format(self.api_root, machine_name))
+        return results['data']
+
+    async def get_cuckoo_status(self):
+        results = await self._request("GET", "{0}/cuckoo/status/".format(self.api_root))
+        return results['data']
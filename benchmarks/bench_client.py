@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measures the throughput and peak memory use of cuckooutils against a mock Cuckoo API server"""
+
+from __future__ import print_function, division
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Queue
+from os.path import abspath, dirname, join
+from resource import getrusage, RUSAGE_SELF
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from cuckooutils import Cuckoo
+
+__version__ = "1.0.0"
+__license__ = """Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS
+    peak_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak_rss / 1048576
+    return peak_rss / 1024
+
+
+def run_concurrently(function, count, workers):
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        list(executor.map(function, range(1, count + 1)))
+    finally:
+        executor.shutdown()
+
+
+def bench_submissions(cuckoo, args):
+    sample = b"MZ" + b"\0" * (args.sample_size - 2)
+    run_concurrently(lambda i: cuckoo.submit_file("sample.exe", sample), args.requests, args.workers)
+    return args.requests, "submissions", args.requests * args.sample_size
+
+
+def bench_status_polls(cuckoo, args):
+    run_concurrently(cuckoo.get_task_status, args.requests, args.workers)
+    return args.requests, "polls", 0
+
+
+def bench_reports(cuckoo, args):
+    response = cuckoo.session.get("{0}/tasks/get/report/1/json".format(cuckoo.api_root), stream=True,
+                                  hooks=dict(response=[]))
+    report_size = int(response.headers.get("content-length") or 0)
+    response.close()
+    run_concurrently(cuckoo.get_task_report, args.reports, args.workers)
+    return args.reports, "reports", args.reports * report_size
+
+
+def bench_artifact_streamed(cuckoo, args):
+    directory = mkdtemp()
+    try:
+        result = cuckoo.download_task_fullmemory(1, join(directory, "memory.dmp"), hashes=("sha256",),
+                                                 resume=False)
+    finally:
+        rmtree(directory)
+    return 1, "downloads", result["size"]
+
+
+def bench_artifact_buffered(cuckoo, args):
+    return 1, "downloads", len(cuckoo.get_task_fullmemory(1).getvalue())
+
+
+benchmarks = [
+    ("submissions", bench_submissions),
+    ("status polls", bench_status_polls),
+    ("json reports", bench_reports),
+    ("artifact, streamed", bench_artifact_streamed),
+    ("artifact, buffered", bench_artifact_buffered),
+]
+
+
+def run_benchmark(function, url, args, results):
+    cuckoo = Cuckoo(url, pool_maxsize=args.workers)
+    start_time = time()
+    operations, unit, transferred = function(cuckoo, args)
+    elapsed = time() - start_time
+    results.put((operations, unit, transferred, elapsed, peak_rss_mb()))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="The root URL of a running mock server. Default: start one")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Server latency per request in seconds, when starting a server. Default: 0")
+    parser.add_argument("--report-size", type=int, default=8388608,
+                        help="JSON report size in bytes, when starting a server. Default: 8388608")
+    parser.add_argument("--artifact-size", type=int, default=268435456,
+                        help="Artifact size in bytes, when starting a server. Default: 268435456")
+    parser.add_argument("--sample-size", type=int, default=65536,
+                        help="Size of submitted samples in bytes. Default: 65536")
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="Number of submissions and status polls. Default: 2000")
+    parser.add_argument("--reports", type=int, default=20, help="Number of reports to download. Default: 20")
+    parser.add_argument("--workers", type=int, default=8, help="Number of client threads. Default: 8")
+    parser.add_argument("--skip-buffered", action="store_true",
+                        help="Skip the buffered artifact download, which needs memory for the whole artifact")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = Popen([sys.executable, join(dirname(abspath(__file__)), "mock_cuckoo.py"), "--port", "0",
+                        "--latency", str(args.latency), "--report-size", str(args.report_size),
+                        "--artifact-size", str(args.artifact_size)], stdout=PIPE, universal_newlines=True)
+        url = server.stdout.readline().split()[-1]
+
+    print("{0:<20} {1:>20} {2:>10} {3:>10} {4:>13}".format("Benchmark", "Operations/s", "MB/s", "Seconds",
+                                                           "Peak RSS MB"))
+    try:
+        for name, function in benchmarks:
+            if args.skip_buffered and function is bench_artifact_buffered:
+                continue
+            # Each benchmark runs in its own process, so peak RSS is measured separately
+            results = Queue()
+            process = Process(target=run_benchmark, args=(function, url, args, results))
+            process.start()
+            operations, unit, transferred, elapsed, peak_rss = results.get()
+            process.join()
+            print("{0:<20} {1:>20} {2:>10.1f} {3:>10.2f} {4:>13.1f}".format(
+                name, "{0:.1f} {1}".format(operations / elapsed, unit), transferred / elapsed / 1048576, elapsed,
+                peak_rss))
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compares the throughput of cuckooutils hash classification with the original regex loop"""
+
+from __future__ import print_function
+
+from hashlib import md5, sha1, sha256
+from re import match
+from timeit import timeit
+from os.path import abspath, dirname
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from cuckooutils import classify_hashes, get_hash_type
+
+__version__ = "1.0.0"
+__license__ = """Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+legacy_hash_regex = {r'[a-fA-F\d]{32}': "md5", r"[a-fA-F\d]{40}": "sha1", r"[a-fA-F\d]{64}": "sha256"}
+
+
+def legacy_get_hash_type(file_hash):
+    for regex in legacy_hash_regex:
+        if match(regex, file_hash):
+            return legacy_hash_regex[regex]
+    raise ValueError("{0} is not a valid md5, sha1, or sha256 hash".format(file_hash))
+
+
+def classify_one_by_one(get_type, file_hashes):
+    results = dict(md5=[], sha1=[], sha256=[], invalid=[])
+    for file_hash in file_hashes:
+        try:
+            results[get_type(file_hash)].append(file_hash)
+        except ValueError:
+            results["invalid"].append(file_hash)
+    return results
+
+
+def main(count=100000, repeat=5):
+    file_hashes = []
+    for i in range(count // 3):
+        data = str(i).encode("ascii")
+        file_hashes += [md5(data).hexdigest(), sha1(data).hexdigest(), sha256(data).hexdigest()]
+    file_hashes.append("not a hash")
+
+    results = [
+        ("legacy get_hash_type", lambda: classify_one_by_one(legacy_get_hash_type, file_hashes)),
+        ("get_hash_type", lambda: classify_one_by_one(get_hash_type, file_hashes)),
+        ("classify_hashes", lambda: classify_hashes(file_hashes)),
+    ]
+    legacy = classify_one_by_one(legacy_get_hash_type, file_hashes)
+    print("The legacy function classifies {0} of {1} sha1 and sha256 hashes as md5".format(
+        len(legacy["md5"]) - len(file_hashes) // 3, len(file_hashes) // 3 * 2))
+    print("Classifying {0} hashes, best of {1}".format(len(file_hashes), repeat))
+    for name, function in results:
+        seconds = min(timeit(function, number=1) for _ in range(repeat))
+        print("{0:>22}: {1:8.3f} s {2:12,.0f} hashes/s".format(name, seconds, len(file_hashes) / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A lightweight stand-in for the cuckoo-modified REST API, for benchmarking cuckooutils"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from itertools import count
+from threading import Lock
+from time import sleep
+import json
+import re
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+__version__ = "1.0.0"
+__license__ = """Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+statuses = ("pending", "running", "completed", "reported")
+artifacts = ("pcap", "fullmemory", "procmemory", "dropped", "surifile", "screenshot")
+# Artifacts are generated from this block, so multi-GB artifacts never need to be held in memory
+artifact_block = bytes(bytearray(range(256))) * 256
+
+
+def build_report(size):
+    """Returns a JSON report of roughly size bytes, shaped like a cuckoo-modified behavior report"""
+    call = dict(api="NtCreateFile", status=True, return_value=0,
+                arguments=[dict(name="FileName", value="C:\\Windows\\Temp\\sample.tmp")])
+    call_size = len(json.dumps(call)) + 2
+    calls = [call] * max(1, size // call_size)
+    report = dict(info=dict(id=1), malscore=5.5,
+                  signatures=[dict(name="injection_runpe", severity=3)],
+                  network=dict(hosts=["192.0.2.1"], domains=[dict(domain="example.com", ip="192.0.2.1")]),
+                  dropped=[dict(sha256="a" * 64, name="dropped.exe")],
+                  behavior=dict(processes=[dict(process_id=1, calls=calls)]))
+    return json.dumps(dict(error=False, data=report)).encode("utf-8")
+
+
+class MockCuckooServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, report_size=1048576, artifact_size=16777216):
+        HTTPServer.__init__(self, address, MockCuckooHandler)
+        self.latency = latency
+        self.artifact_size = artifact_size
+        self.report = build_report(report_size)
+        self.task_ids = count(1)
+        self.lock = Lock()
+
+    def next_task_id(self):
+        with self.lock:
+            return next(self.task_ids)
+
+
+class MockCuckooHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and bodies are written separately, so Nagle's algorithm would add a delay to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, data, error_value=None):
+        if error_value:
+            body = dict(error=True, error_value=error_value)
+        else:
+            body = dict(error=False, data=data)
+        body = json.dumps(body).encode("utf-8")
+        self._send(body)
+
+    def _send(self, body, content_type="application/json"):
+        self.send_response(200)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_artifact(self):
+        size = self.server.artifact_size
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("range") or "")
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("content-length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("content-range", "bytes {0}-{1}/{2}".format(start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header("content-type", "application/octet-stream")
+        self.send_header("content-length", str(size - start))
+        self.end_headers()
+        block_size = len(artifact_block)
+        position = start
+        while position < size:
+            offset = position % block_size
+            chunk = artifact_block[offset:offset + min(block_size - offset, size - position)]
+            self.wfile.write(chunk)
+            position += len(chunk)
+
+    def _discard_body(self):
+        # Uploads are read and discarded in chunks, so large submissions do not use server memory
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                chunk_size = int(self.rfile.readline().split(b";")[0], 16)
+                if chunk_size == 0:
+                    self.rfile.readline()
+                    break
+                self.rfile.read(chunk_size + 2)
+            return
+        remaining = int(self.headers.get("content-length") or 0)
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 65536)))
+
+    def do_POST(self):
+        if self.server.latency:
+            sleep(self.server.latency)
+        self._discard_body()
+        path = self.path.split("/api/", 1)[-1].strip("/")
+        if path.startswith("tasks/create/"):
+            self._send_json(dict(task_ids=[self.server.next_task_id()]))
+        elif path == "tasks/extendedsearch":
+            self._send_json([dict(id=i, status="reported") for i in range(1, 101)])
+        else:
+            self._send_json(None, error_value="Unknown endpoint")
+
+    def do_GET(self):
+        if self.server.latency:
+            sleep(self.server.latency)
+        segments = self.path.split("/api/", 1)[-1].strip("/").split("/")
+        if segments[:2] == ["tasks", "status"]:
+            self._send_json(statuses[int(segments[2]) % len(statuses)])
+        elif segments[:2] == ["tasks", "search"]:
+            self._send_json([])
+        elif segments[:2] == ["tasks", "view"]:
+            task_id = int(segments[2])
+            self._send_json(dict(id=task_id, status=statuses[task_id % len(statuses)]))
+        elif segments[:2] == ["tasks", "list"]:
+            limit = int(segments[2]) if len(segments) > 2 else 100
+            offset = int(segments[3]) if len(segments) > 3 else 0
+            self._send_json([dict(id=i, status=statuses[i % len(statuses)], tags=[])
+                             for i in range(offset + 1, offset + limit + 1)])
+        elif segments[:3] == ["tasks", "get", "report"]:
+            self._send(self.server.report)
+        elif segments[:3] == ["tasks", "get", "iocs"]:
+            self._send_json(dict(signatures=[dict(name="injection_runpe")], network=dict(hosts=["192.0.2.1"])))
+        elif segments[:2] == ["tasks", "get"] and segments[2] in artifacts:
+            self._send_artifact()
+        elif segments[:2] == ["cuckoo", "status"]:
+            self._send_json(dict(tasks=dict(total=0, pending=0, running=0, completed=0, reported=0)))
+        elif segments[:2] == ["machines", "list"]:
+            self._send_json([dict(name="win7-1", label="win7-1", locked=False, status="poweroff", tags=[])])
+        else:
+            self._send_json(None, error_value="Unknown endpoint")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on. Default: 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090, help="Port to listen on. Default: 8090")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to wait before answering each request. Default: 0")
+    parser.add_argument("--report-size", type=int, default=1048576,
+                        help="Approximate size of JSON reports in bytes. Default: 1048576")
+    parser.add_argument("--artifact-size", type=int, default=16777216,
+                        help="Size of pcaps, memory dumps, and other artifacts in bytes. Default: 16777216")
+    args = parser.parse_args()
+
+    server = MockCuckooServer((args.host, args.port), latency=args.latency, report_size=args.report_size,
+                              artifact_size=args.artifact_size)
+    print("Listening on http://{0}:{1}".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
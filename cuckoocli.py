@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+"""A single entry point for the cuckoo-modified-utils scripts, which can hand commands to a long-lived local process"""
+
+"""Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+# Only lightweight modules are imported here, so handing a command to a running server stays fast. requests,
+# cuckooutils, and the scripts themselves are imported when a command is actually run.
+from argparse import ArgumentParser, REMAINDER
+from os import environ, getcwd, pathsep, path
+from threading import Lock
+import json
+import socket
+import sys
+
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import SafeConfigParser as ConfigParser
+
+__version__ = "1.0.0"
+
+commands = {"submit": "submit-to-cuckoo.py", "tor": "tor-to-cuckoo.py", "wildfire": "wildfire-to-cuckoo.py"}
+
+default_config_path = path.join(path.expanduser("~"), ".cuckoo-utils.ini")
+default_config = {"root": "https://cuckoo.example.net", "username": "username", "password": "password",
+                  "verify": "true", "wildfire_api_key": "api-key-goes-here", "socket": None}
+config_environment = {"root": "CUCKOO_ROOT", "username": "CUCKOO_USERNAME", "password": "CUCKOO_PASSWORD",
+                      "verify": "CUCKOO_VERIFY", "wildfire_api_key": "WILDFIRE_API_KEY",
+                      "socket": "CUCKOO_UTILS_SOCKET"}
+
+_clients = {}
+_clients_lock = Lock()
+_context = None
+
+
+def load_config(config_path=None):
+    """Returns the settings in the [cuckoo-utils] section of a config file, overridden by environment variables
+
+    The config file is config_path, $CUCKOO_UTILS_CONFIG, or ~/.cuckoo-utils.ini, and does not need to exist. In
+    a command run by a server, the settings are those the client loaded."""
+    if config_path is None and getattr(_context, "config", None) is not None:
+        return dict(_context.config)
+    config = dict(default_config)
+    parser = ConfigParser()
+    parser.read(config_path or environ.get("CUCKOO_UTILS_CONFIG") or default_config_path)
+    if parser.has_section("cuckoo-utils"):
+        for key in config:
+            if parser.has_option("cuckoo-utils", key):
+                config[key] = parser.get("cuckoo-utils", key)
+    for key in config_environment:
+        if config_environment[key] in environ:
+            config[key] = environ[config_environment[key]]
+
+    return config
+
+
+def _parse_verify(verify):
+    if verify.lower() in ("false", "no", "off", "0"):
+        return False
+    if verify.lower() in ("true", "yes", "on", "1"):
+        return True
+    # A path to a CA bundle
+    return verify
+
+
+def _new_cuckoo(config):
+    from cuckooutils import Cuckoo
+    return Cuckoo(config["root"], config["username"], config["password"], verify=_parse_verify(config["verify"]))
+
+
+def get_cuckoo(config=None):
+    """Returns a Cuckoo client for a config, which is shared with every other caller in this process
+
+    In a command run by a server started with cuckoo-utils serve, each command gets its own client, so settings such
+    as --stats only apply to that command, but every client uses the same connection pools, so connections to
+    Cuckoo stay open from one command to the next."""
+    if config is None:
+        config = load_config()
+    key = (config["root"], config["username"], config["password"], config["verify"])
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = _new_cuckoo(config)
+        shared = _clients[key]
+    command_clients = getattr(_context, "clients", None)
+    if command_clients is None:
+        return shared
+    if key not in command_clients:
+        cuckoo = _new_cuckoo(config)
+        for prefix in ("http://", "https://"):
+            cuckoo.session.mount(prefix, shared.session.get_adapter(prefix))
+        command_clients[key] = cuckoo
+    return command_clients[key]
+
+
+def find_script(file_name):
+    """Returns the path of a script, looking next to this module, in the scripts directory, then on the PATH"""
+    from sysconfig import get_path
+    directories = [path.dirname(path.abspath(__file__)), get_path("scripts")]
+    directories += environ.get("PATH", "").split(pathsep)
+    for directory in directories:
+        script_path = path.join(directory, file_name)
+        if path.isfile(script_path):
+            return script_path
+    raise IOError("Unable to find {0}".format(file_name))
+
+
+def _exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write("{0}\n".format(code))
+    return 1
+
+
+def run_command(command, arguments):
+    """Runs a command's script in this process, and returns its exit status"""
+    script_path = find_script(commands[command])
+    if _context is not None:
+        # Running in a server, where each thread has its own arguments
+        _context.argv = [script_path] + list(arguments)
+        return _run_path(script_path)
+    argv = sys.argv
+    sys.argv = [script_path] + list(arguments)
+    try:
+        return _run_path(script_path)
+    finally:
+        sys.argv = argv
+
+
+def _run_path(script_path):
+    from runpy import run_path
+    try:
+        run_path(script_path, run_name="__main__")
+    except SystemExit as e:
+        return _exit_status(e.code)
+    return 0
+
+
+def _receive_line(connection, data=b""):
+    while not data.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk:
+            raise IOError("The connection was closed")
+        data += chunk
+    return json.loads(data.decode("utf-8"))
+
+
+def send_command(socket_path, command, arguments):
+    """Hands a command, and this process's settings, working directory, standard input, output, and error, to a
+    server started with serve, and returns the command's exit status"""
+    from array import array
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        message = json.dumps(dict(command=command, arguments=arguments, cwd=getcwd(), config=load_config()))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        client.sendmsg([message.encode("utf-8") + b"\n"],
+                       [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array("i", [0, 1, 2]))])
+        return _receive_line(client)["status"]
+    finally:
+        client.close()
+
+
+class _ThreadLocalStream(object):
+    """Sends reads and writes to the stream of the command the current thread is running"""
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def __getattr__(self, attribute):
+        return getattr(getattr(_context, self.name, None) or self.default, attribute)
+
+
+class _ThreadLocalArgv(list):
+    """The arguments of the command the current thread is running, for argparse"""
+
+    def _argv(self):
+        return getattr(_context, "argv", None) or list(self)
+
+    def __getitem__(self, index):
+        return self._argv()[index]
+
+    def __len__(self):
+        return len(self._argv())
+
+    def __iter__(self):
+        return iter(self._argv())
+
+
+def _register(function, *args, **kwargs):
+    # Commands run by the server register exit functions, such as --stats, which run when the command finishes
+    exit_functions = getattr(_context, "exit_functions", None)
+    if exit_functions is None:
+        return _atexit_register(function, *args, **kwargs)
+    exit_functions.append((function, args, kwargs))
+    return function
+
+
+_atexit_register = None
+
+
+class _WorkingDirectory(object):
+    """The working directory of a server, which is shared by every command it is running
+
+    Commands from the same directory run at once. A command from another directory waits until no commands are
+    running, then the server changes to its directory."""
+
+    def __init__(self):
+        from threading import Condition
+        self.condition = Condition()
+        self.directory = getcwd()
+        self.active = 0
+
+    def enter(self, directory):
+        from os import chdir
+        with self.condition:
+            while self.active > 0 and directory != self.directory:
+                self.condition.wait()
+            if directory != self.directory:
+                chdir(directory)
+                self.directory = directory
+            self.active += 1
+
+    def exit(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+
+_working_directory = None
+
+
+def _handle(connection):
+    from array import array
+    from io import open as open_fd
+    from traceback import print_exc
+    fds = array("i")
+    data, ancillary_data, flags, address = connection.recvmsg(65536, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, message_type, message_data in ancillary_data:
+        if level == socket.SOL_SOCKET and message_type == socket.SCM_RIGHTS:
+            fds.frombytes(message_data[:len(message_data) - (len(message_data) % fds.itemsize)])
+    if len(fds) != 3:
+        connection.close()
+        return
+    streams = [open_fd(fds[0], "r", closefd=True), open_fd(fds[1], "w", closefd=True),
+               open_fd(fds[2], "w", 1, closefd=True)]
+    status = 1
+    try:
+        request = _receive_line(connection, data)
+        _context.stdin, _context.stdout, _context.stderr = streams
+        _context.exit_functions = []
+        _context.config = request["config"]
+        _context.clients = {}
+        _working_directory.enter(request["cwd"])
+        try:
+            try:
+                status = run_command(request["command"], request["arguments"])
+            except Exception:
+                print_exc(file=_context.stderr)
+            for function, args, kwargs in reversed(_context.exit_functions):
+                try:
+                    function(*args, **kwargs)
+                except Exception:
+                    print_exc(file=_context.stderr)
+        finally:
+            _working_directory.exit()
+        for stream in streams:
+            try:
+                stream.flush()
+            except (IOError, OSError, ValueError):
+                pass
+        connection.sendall(json.dumps(dict(status=status)).encode("utf-8") + b"\n")
+    finally:
+        _context.__dict__.clear()
+        for stream in streams:
+            try:
+                stream.close()
+            except (IOError, OSError, ValueError):
+                pass
+        connection.close()
+
+
+def serve(socket_path):
+    """Runs commands handed to a Unix socket by cuckoo-utils, each in its own thread
+
+    Modules are imported once, and the clients returned by get_cuckoo share connection pools, so a command costs a
+    few milliseconds to start, and does not open new connections to Cuckoo. Each command runs with the settings and
+    working directory of its client. Requires Python 3.3 or later."""
+    global _context, _atexit_register, _working_directory
+    import atexit
+    from os import chmod, remove
+    from threading import Thread, local
+    if not hasattr(socket.socket, "sendmsg"):
+        raise RuntimeError("Serving commands requires Python 3.3 or later")
+    _context = local()
+    _working_directory = _WorkingDirectory()
+    _atexit_register = atexit.register
+    atexit.register = _register
+    sys.stdin = _ThreadLocalStream("stdin", sys.stdin)
+    sys.stdout = _ThreadLocalStream("stdout", sys.stdout)
+    sys.stderr = _ThreadLocalStream("stderr", sys.stderr)
+    sys.argv = _ThreadLocalArgv(sys.argv)
+
+    # Import the heavy modules, and connect to Cuckoo, before the first command arrives
+    get_cuckoo()
+    try:
+        import pyldfire
+    except ImportError:
+        pass
+
+    if path.exists(socket_path):
+        remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    chmod(socket_path, 0o600)
+    server.listen(128)
+    try:
+        while True:
+            connection, address = server.accept()
+            thread = Thread(target=_handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+    finally:
+        server.close()
+        remove(socket_path)
+
+
+def main():
+    parser = ArgumentParser(prog="cuckoo-utils", description=__doc__)
+    parser.add_argument("-v", "--version", action="version", version=__version__)
+    parser.add_argument("--config",
+                        help="A config file to use instead of $CUCKOO_UTILS_CONFIG or ~/.cuckoo-utils.ini")
+    parser.add_argument("--socket",
+                        help="The Unix socket of a server started with serve. Default: the socket setting")
+    parser.add_argument("--local", action="store_true",
+                        help="Run the command in this process, even if a server is configured")
+    parser.add_argument("command", choices=sorted(commands) + ["serve"],
+                        help="The command to run, or serve, to run commands handed to --socket")
+    parser.add_argument("arguments", nargs=REMAINDER, help="Arguments for the command. Use -h to list them")
+    args = parser.parse_args()
+
+    if args.config:
+        environ["CUCKOO_UTILS_CONFIG"] = args.config
+    socket_path = args.socket or load_config()["socket"]
+
+    if args.command == "serve":
+        if not socket_path:
+            parser.error("serve requires --socket, or the socket setting")
+        try:
+            serve(socket_path)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if socket_path and not args.local and hasattr(socket.socket, "sendmsg") and path.exists(socket_path):
+        try:
+            status = send_command(socket_path, args.command, args.arguments)
+        except ConnectionRefusedError:
+            # The server is not running, so run the command here instead
+            status = run_command(args.command, args.arguments)
+        sys.exit(status)
+    sys.exit(run_command(args.command, args.arguments))
+
+
+if __name__ == "__main__":
+    # Commands import cuckoocli, which must be this module, not a second copy of it
+    sys.modules.setdefault("cuckoocli", sys.modules[__name__])
+    main()
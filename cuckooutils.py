@@ -17,47 +17,854 @@ See the License for the specific language governing permissions and
 limitations under the License."""
 
 from hashlib import md5, sha1, sha256
-from re import match
+from binascii import unhexlify
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from os import path, walk, listdir, makedirs, remove, rename, utime
+from zlib import compress, decompress
+import csv
+import json
+import pickle
+from mmap import mmap, ACCESS_READ
+from time import sleep, time
+from collections import deque
+from array import array
+from heapq import heappop, heappush
+from itertools import count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from threading import Lock
+from random import uniform
+from uuid import uuid4
+import sqlite3
+import tarfile
+import zipfile
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
 from requests import session
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+from requests.compat import urlparse
+from requests.exceptions import ConnectionError as RequestsConnectionError, HTTPError, RequestException, Timeout
+from requests.packages.urllib3.util.retry import Retry
+from io import BytesIO, StringIO
+
+try:
+    # SpooledTemporaryFile keeps its data in a cStringIO in Python 2
+    from cStringIO import InputType, OutputType
+    _memory_file_types = (BytesIO, StringIO, InputType, OutputType)
+except ImportError:
+    _memory_file_types = (BytesIO, StringIO)
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from sys import intern
+except ImportError:
+    # intern is a builtin in Python 2
+    pass
 
 __version__ = "1.0.2"
 
 hash_types = {"md5": md5, "sha1": sha1, "sha256": sha256}
-hash_regex = {r'[a-fA-F\d]{32}': "md5", r"[a-fA-F\d]{40}": "sha1", r"[a-fA-F\d]{64}": "sha256"}
+hash_regex = {r'[a-fA-F\d]{32}\Z': "md5", r"[a-fA-F\d]{40}\Z": "sha1", r"[a-fA-F\d]{64}\Z": "sha256"}
+hash_lengths = {32: "md5", 40: "sha1", 64: "sha256"}
+# Artifacts that can be fetched with Cuckoo.fetch_task_bundle, and the file name each is saved as
+bundle_artifacts = {"report": "report.json", "pcap": "dump.pcap", "screenshot": "screenshots.zip",
+                    "dropped": "dropped.tar.bz2", "procmemory": "procmemory.tar.bz2", "fullmemory": "memory.dmp",
+                    "surifile": "suri_files.tar.bz2"}
+
+
+def _is_hex(value):
+    # Much faster than a regular expression, and just as strict
+    try:
+        unhexlify(value)
+    except (TypeError, ValueError):
+        return False
+    return True
 
 
 def get_hash_type(file_hash):
-    for regex in hash_regex:
-        if match(regex, file_hash):
-            return hash_regex[regex]
-    raise ValueError("{0} is not a valid md5, sha1, or sha256 hash".format(file_hash))
+    hash_type = hash_lengths.get(len(file_hash))
+    if hash_type is None or not _is_hex(file_hash):
+        raise ValueError("{0} is not a valid md5, sha1, or sha256 hash".format(file_hash))
+    return hash_type
+
+
+def classify_hashes(file_hashes):
+    """Sorts hashes by type, and returns a dict of md5, sha1, sha256, and invalid lists
+
+    Surrounding whitespace is removed, so lines read from a file can be passed as is."""
+    results = dict(md5=[], sha1=[], sha256=[], invalid=[])
+    buckets = dict((length, results[hash_lengths[length]]) for length in hash_lengths)
+    invalid = results["invalid"]
+    for file_hash in file_hashes:
+        file_hash = file_hash.strip()
+        bucket = buckets.get(len(file_hash))
+        if bucket is None:
+            invalid.append(file_hash)
+            continue
+        try:
+            unhexlify(file_hash)
+        except (TypeError, ValueError):
+            invalid.append(file_hash)
+            continue
+        bucket.append(file_hash)
+
+    return results
 
 
 def get_file_hash(file_obj, hash_type="sha256", block_size=65536):
-    try:
-        hasher = hash_types[hash_type.lower()]()
-    except KeyError:
+    return get_file_hashes(file_obj, hashes=(hash_type,), block_size=block_size)[hash_type.lower()]
+
+
+def get_file_hashes(file_obj, hashes=("md5", "sha1", "sha256"), block_size=65536):
+    """Returns a dict of hash type to hash, computing every hash in a single pass over the file
+
+    Files on disk are memory mapped. Other file objects, including SpooledTemporaryFiles that are still in memory,
+    are read into a single reusable buffer."""
+    hashers = _new_hashers(hashes)
+    if len(hashers) == 0:
         raise ValueError("Invalid hash type")
     file_obj.seek(0)
-    buffer = file_obj.read(block_size)
-    while len(buffer) > 0:
-        hasher.update(buffer)
+    mapped_file = None
+    # Calling fileno on a SpooledTemporaryFile writes it to disk. Whether it is still in memory is only visible in its
+    # private _file attribute, which is a CPython implementation detail, so a missing attribute counts as in memory.
+    in_memory = isinstance(file_obj, SpooledTemporaryFile) and isinstance(getattr(file_obj, "_file", None),
+                                                                          _memory_file_types + (type(None),))
+    if not in_memory:
+        try:
+            mapped_file = mmap(file_obj.fileno(), 0, access=ACCESS_READ)
+        except (AttributeError, IOError, OSError, ValueError):
+            # Not a file on disk, or an empty one
+            mapped_file = None
+    if mapped_file is not None:
+        try:
+            view = memoryview(mapped_file)
+            for offset in range(0, len(mapped_file), block_size):
+                block = view[offset:offset + block_size]
+                for hasher in hashers.values():
+                    hasher.update(block)
+                del block
+            # The map cannot be closed while views of it exist
+            del view
+        finally:
+            mapped_file.close()
+    elif hasattr(file_obj, "readinto"):
+        buffer = bytearray(block_size)
+        view = memoryview(buffer)
+        size = file_obj.readinto(buffer)
+        while size:
+            for hasher in hashers.values():
+                hasher.update(view[:size])
+            size = file_obj.readinto(buffer)
+    else:
         buffer = file_obj.read(block_size)
+        while len(buffer) > 0:
+            for hasher in hashers.values():
+                hasher.update(buffer)
+            buffer = file_obj.read(block_size)
     file_obj.seek(0)
-    return hasher.hexdigest()
+    return dict((hash_type, hashers[hash_type].hexdigest()) for hash_type in hashers)
+
+
+def _hash_file_path(file_path, hashes=("sha256",)):
+    with open(file_path, "rb") as file_obj:
+        return get_file_hashes(file_obj, hashes=hashes)
+
+
+def hash_files(file_paths, hash_type="sha256", max_workers=None):
+    """Hashes many files on a pool of processes, and returns a dict of file path to hash"""
+    file_hashes = hash_files_many(file_paths, hashes=(hash_type,), max_workers=max_workers)
+    return dict((file_path, file_hashes[file_path][hash_type.lower()]) for file_path in file_hashes)
+
+
+def hash_files_many(file_paths, hashes=("md5", "sha1", "sha256"), max_workers=None):
+    """Hashes many files on a pool of processes, and returns a dict of file path to a dict of hash type to hash"""
+    file_paths = list(file_paths)
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        file_hashes = executor.map(_hash_file_path, file_paths, [tuple(hashes)] * len(file_paths),
+                                   chunksize=max(1, len(file_paths) // 256))
+        return dict(zip(file_paths, file_hashes))
+    finally:
+        executor.shutdown()
+
+
+def hash_directory(directory, hashes=("md5", "sha1", "sha256"), recursive=True, max_workers=None):
+    """Hashes every file in a directory across all CPU cores, and returns a dict of file path to a dict of hash
+    type to hash"""
+    file_paths = []
+    for root, directories, file_names in walk(directory):
+        file_paths += [path.join(root, file_name) for file_name in file_names]
+        if not recursive:
+            break
+
+    return hash_files_many(file_paths, hashes=hashes, max_workers=max_workers)
+
+
+def _new_hashers(hashes):
+    hashers = {}
+    for hash_type in hashes or ():
+        try:
+            hashers[hash_type.lower()] = hash_types[hash_type.lower()]()
+        except KeyError:
+            raise ValueError("Invalid hash type")
+    return hashers
+
+
+def _normalize_status(status):
+    # Workaround the difference in status names in web API and UI
+    if status == "completed":
+        status = "processing"
+
+    return status
+
+
+class TokenBucket(object):
+    """A thread safe token bucket rate limiter, allowing rate requests per second, in bursts of up to capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time()
+        self.lock = Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until the given number of tokens are available, then takes them"""
+        while True:
+            with self.lock:
+                now = time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            sleep(wait)
+
+
+class _JitteredRetry(Retry):
+    def get_backoff_time(self):
+        # Full jitter keeps many clients from retrying in lockstep
+        return uniform(0, super(_JitteredRetry, self).get_backoff_time())
+
+
+class _CuckooAdapter(HTTPAdapter):
+    """Applies a default timeout and per-endpoint rate limits to every request"""
+
+    def __init__(self, timeout=None, rate_limits=None, **kwargs):
+        self.timeout = timeout
+        self.rate_limits = sorted((rate_limits or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        super(_CuckooAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        if self.rate_limits:
+            endpoint = urlparse(request.url).path.split("/api/", 1)[-1]
+            for prefix, bucket in self.rate_limits:
+                if endpoint.startswith(prefix):
+                    bucket.acquire()
+                    break
+        return super(_CuckooAdapter, self).send(request, **kwargs)
+
+
+class ClientStats(object):
+    """Thread safe per-endpoint request counts, status codes, bytes transferred, and latency histograms
+
+    Endpoints are API paths with task IDs and hashes replaced by {id} and {hash}. Bytes are counted from
+    Content-Length headers, and latency is the time until the response headers were received."""
+
+    latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time()
+        self.endpoints = {}
+
+    @staticmethod
+    def endpoint_name(url):
+        segments = []
+        for segment in urlparse(url).path.split("/api/", 1)[-1].strip("/").split("/"):
+            if segment.isdigit():
+                segment = "{id}"
+            elif len(segment) in hash_lengths and _is_hex(segment):
+                segment = "{hash}"
+            segments.append(segment)
+        return "/".join(segments)
+
+    def record(self, response, *args, **kwargs):
+        """A requests response hook"""
+        endpoint = "{0} {1}".format(response.request.method, self.endpoint_name(response.url))
+        latency = response.elapsed.total_seconds()
+        bytes_sent = int(response.request.headers.get("content-length") or 0)
+        bytes_received = int(response.headers.get("content-length") or 0)
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = dict(count=0, bytes_sent=0, bytes_received=0, latency_sum=0.0, status_codes={},
+                             latency_counts=[0] * len(self.latency_buckets))
+                self.endpoints[endpoint] = stats
+            stats["count"] += 1
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["latency_sum"] += latency
+            stats["status_codes"][response.status_code] = stats["status_codes"].get(response.status_code, 0) + 1
+            for i, bucket in enumerate(self.latency_buckets):
+                if latency <= bucket:
+                    stats["latency_counts"][i] += 1
+                    break
+
+    def _percentile(self, latency_counts, percentile):
+        # Interpolates within the histogram bucket that holds the percentile
+        target = sum(latency_counts) * percentile
+        cumulative = 0
+        lower = 0.0
+        for bucket, bucket_count in zip(self.latency_buckets, latency_counts):
+            if bucket_count > 0 and cumulative + bucket_count >= target:
+                if bucket == float("inf"):
+                    return lower
+                return lower + (bucket - lower) * (target - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bucket
+        return lower
+
+    def snapshot(self):
+        """Returns a dict of endpoint to a dict of statistics"""
+        with self.lock:
+            snapshot = {}
+            for endpoint in self.endpoints:
+                stats = self.endpoints[endpoint]
+                snapshot[endpoint] = dict(count=stats["count"], bytes_sent=stats["bytes_sent"],
+                                          bytes_received=stats["bytes_received"],
+                                          status_codes=dict(stats["status_codes"]),
+                                          latency_mean=stats["latency_sum"] / stats["count"],
+                                          latency_p50=self._percentile(stats["latency_counts"], 0.5),
+                                          latency_p95=self._percentile(stats["latency_counts"], 0.95),
+                                          latency_p99=self._percentile(stats["latency_counts"], 0.99))
+            return snapshot
+
+    def to_prometheus(self, prefix="cuckoo_client"):
+        """Returns the statistics in the Prometheus text exposition format"""
+        lines = ["# TYPE {0}_requests_total counter".format(prefix),
+                 "# TYPE {0}_bytes_sent_total counter".format(prefix),
+                 "# TYPE {0}_bytes_received_total counter".format(prefix),
+                 "# TYPE {0}_request_duration_seconds histogram".format(prefix)]
+        with self.lock:
+            for endpoint in sorted(self.endpoints):
+                stats = self.endpoints[endpoint]
+                method, name = endpoint.split(" ", 1)
+                labels = 'method="{0}",endpoint="{1}"'.format(method, name)
+                for status_code in sorted(stats["status_codes"]):
+                    lines.append('{0}_requests_total{{{1},code="{2}"}} {3}'.format(
+                        prefix, labels, status_code, stats["status_codes"][status_code]))
+                lines.append("{0}_bytes_sent_total{{{1}}} {2}".format(prefix, labels, stats["bytes_sent"]))
+                lines.append("{0}_bytes_received_total{{{1}}} {2}".format(prefix, labels, stats["bytes_received"]))
+                cumulative = 0
+                for bucket, bucket_count in zip(self.latency_buckets, stats["latency_counts"]):
+                    cumulative += bucket_count
+                    le = "+Inf" if bucket == float("inf") else repr(bucket)
+                    lines.append('{0}_request_duration_seconds_bucket{{{1},le="{2}"}} {3}'.format(
+                        prefix, labels, le, cumulative))
+                lines.append("{0}_request_duration_seconds_sum{{{1}}} {2}".format(prefix, labels,
+                                                                                 stats["latency_sum"]))
+                lines.append("{0}_request_duration_seconds_count{{{1}}} {2}".format(prefix, labels,
+                                                                                   stats["count"]))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Returns a human readable table of the statistics"""
+        snapshot = self.snapshot()
+        lines = ["{0:<40} {1:>6} {2:>9} {3:>9} {4:>9} {5:>10}  {6}".format(
+            "Endpoint", "Count", "p50 ms", "p95 ms", "p99 ms", "KB in", "Status codes")]
+        for endpoint in sorted(snapshot):
+            stats = snapshot[endpoint]
+            lines.append("{0:<40} {1:>6} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>10.1f}  {6}".format(
+                endpoint, stats["count"], stats["latency_p50"] * 1000, stats["latency_p95"] * 1000,
+                stats["latency_p99"] * 1000, stats["bytes_received"] / 1024.0,
+                ", ".join("{0}: {1}".format(code, stats["status_codes"][code])
+                          for code in sorted(stats["status_codes"]))))
+        lines.append("{0} requests in {1:.1f} seconds".format(sum(stats["count"] for stats in snapshot.values()),
+                                                             time() - self.started))
+        return "\n".join(lines) + "\n"
+
+
+class _MultipartUpload(object):
+    """A file-like multipart/form-data body that reads the file being uploaded as the request is sent
+
+    The file is hashed as it is read, so the hash is available once the body has been sent. If the size of the file
+    cannot be determined, len is None, and the body should be sent chunked by iterating over it."""
+
+    def __init__(self, fields, file_field, file_name, file_obj, hash_type="sha256", chunk_size=65536):
+        boundary = uuid4().hex
+        self.content_type = "multipart/form-data; boundary={0}".format(boundary)
+        self.chunk_size = chunk_size
+        head = ""
+        for name in fields:
+            head += '--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'.format(
+                boundary, name, fields[name])
+        head += '--{0}\r\nContent-Disposition: form-data; name="{1}"; filename="{2}"\r\n' \
+                'Content-Type: application/octet-stream\r\n\r\n'.format(
+                    boundary, file_field, file_name.replace("\\", "\\\\").replace('"', '\\"'))
+        head = head.encode("utf-8")
+        tail = "\r\n--{0}--\r\n".format(boundary).encode("utf-8")
+        try:
+            start = file_obj.tell()
+            file_obj.seek(0, 2)
+            file_size = file_obj.tell() - start
+            file_obj.seek(start)
+            self.len = len(head) + file_size + len(tail)
+        except (AttributeError, IOError, OSError):
+            self.len = None
+        self.hasher = hash_types[hash_type]()
+        self._file = file_obj
+        self._parts = [BytesIO(head), file_obj, BytesIO(tail)]
+
+    def __iter__(self):
+        chunk = self.read(self.chunk_size)
+        while len(chunk) > 0:
+            yield chunk
+            chunk = self.read(self.chunk_size)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = float("inf")
+        chunks = []
+        remaining = size
+        while remaining > 0 and len(self._parts) > 0:
+            part = self._parts[0]
+            chunk = part.read(min(remaining, self.chunk_size))
+            if len(chunk) == 0:
+                self._parts.pop(0)
+                continue
+            if part is self._file:
+                self.hasher.update(chunk)
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class _PagedResults(object):
+    """Iterates over pages of results, fetching the next page in the background while the current one is consumed
+
+    offset is the offset of the next result that has not been fully consumed, and can be saved to resume later."""
+
+    def __init__(self, fetch_page, page_size, offset=0):
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.offset = offset
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            page_offset = self.offset
+            future = executor.submit(self.fetch_page, self.page_size, page_offset)
+            previous_page = None
+            while future is not None:
+                page = future.result()
+                if len(page) > self.page_size:
+                    # The server ignored the paging options, and returned every result
+                    page = page[page_offset:]
+                    future = None
+                elif len(page) > 0 and page == previous_page:
+                    # The server ignored the offset, and returned the same page again
+                    break
+                elif len(page) == self.page_size:
+                    future = executor.submit(self.fetch_page, self.page_size, page_offset + len(page))
+                else:
+                    future = None
+                page_offset += len(page)
+                previous_page = page
+                for result in page:
+                    yield result
+                    self.offset += 1
+        finally:
+            executor.shutdown(wait=False)
+
+
+class KnownSampleIndex(object):
+    """A persistent SQLite index of sample hashes to Cuckoo task IDs, which can be shared between threads
+
+    Entries older than ttl seconds (or negative_ttl seconds, for hashes with no tasks) are considered stale, and are
+    looked up again."""
+
+    def __init__(self, database_path, ttl=86400, negative_ttl=3600):
+        self.database_path = database_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = Lock()
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS samples (hash TEXT PRIMARY KEY, hash_type TEXT, "
+                                    "task_ids TEXT, updated REAL)")
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, sample_hashes, include_stale=False):
+        """Returns a dict of sample hash to a list of task IDs for the given hashes that are in the index"""
+        results = {}
+        now = time()
+        sample_hashes = [sample_hash.lower() for sample_hash in sample_hashes]
+        # Stay well below SQLite's limit on query parameters
+        for i in range(0, len(sample_hashes), 500):
+            batch = sample_hashes[i:i + 500]
+            query = "SELECT hash, task_ids, updated FROM samples WHERE hash IN ({0})".format(
+                ",".join("?" * len(batch)))
+            with self.lock:
+                rows = self.connection.execute(query, batch).fetchall()
+            for sample_hash, task_ids, updated in rows:
+                task_ids = [int(task_id) for task_id in task_ids.split(",") if task_id]
+                ttl = self.ttl if len(task_ids) > 0 else self.negative_ttl
+                if include_stale or now - updated < ttl:
+                    results[sample_hash] = task_ids
+
+        return results
+
+    def add(self, sample_hash, task_ids):
+        """Saves the task IDs of a sample, replacing any previous entry"""
+        sample_hash = sample_hash.lower()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)",
+                                    (sample_hash, get_hash_type(sample_hash),
+                                     ",".join(str(task_id) for task_id in task_ids), time()))
+
+
+class ReportCache(object):
+    """A compressed on-disk cache of task reports, which evicts the least recently used reports beyond max_size bytes
+
+    Reports never change once a task is reported, so cached reports are never revalidated. JSON reports are stored
+    pickled when binary is True, which loads several times faster than parsing JSON. Corrupt reports are treated as
+    missing, and removed. The size of the cache is tracked as reports are added, so the directory is only listed
+    when it may need to be evicted.
+
+    Task IDs are only unique to a server, so reports are keyed by a hash of the server's API root as well. A binary
+    cache unpickles whatever it finds in the directory, which can run arbitrary code, so the directory must not be
+    writable by other users."""
+
+    def __init__(self, directory, max_size=1073741824, binary=True, compression_level=1):
+        self.directory = directory
+        self.max_size = max_size
+        self.binary = binary
+        self.compression_level = compression_level
+        self.lock = Lock()
+        # Unknown until the directory is first listed by evict
+        self.size = None
+        if not path.isdir(directory):
+            makedirs(directory)
+
+    def _path(self, task_id, report_format, server=None):
+        if report_format == "json":
+            kind = "pickle" if self.binary else "json"
+        else:
+            kind = "raw"
+        file_name = "{0}.{1}.{2}.z".format(task_id, report_format, kind)
+        if server is not None:
+            file_name = "{0}.{1}".format(sha1(server.encode("utf-8")).hexdigest()[:16], file_name)
+        return path.join(self.directory, file_name)
+
+    def get(self, task_id, report_format="json", server=None):
+        """Returns a cached report of a task on the given server, or None if it is not in the cache"""
+        file_path = self._path(task_id, report_format, server)
+        try:
+            with open(file_path, "rb") as cache_file:
+                compressed = cache_file.read()
+            # Mark the report as recently used
+            utime(file_path, None)
+        except (IOError, OSError):
+            return None
+        try:
+            data = decompress(compressed)
+            if report_format != "json":
+                return data
+            if self.binary:
+                return pickle.loads(data)
+            return json.loads(data.decode("utf-8"))
+        except Exception:
+            # Unpickling corrupt data can raise almost any exception, so any failure is a miss
+            self._remove(file_path, len(compressed))
+            return None
+
+    def _remove(self, file_path, size):
+        try:
+            remove(file_path)
+        except OSError:
+            return
+        with self.lock:
+            if self.size is not None:
+                self.size -= size
+
+    def set(self, task_id, report_format, report, server=None):
+        if report_format != "json":
+            data = report
+        elif self.binary:
+            data = pickle.dumps(report, pickle.HIGHEST_PROTOCOL)
+        else:
+            data = json.dumps(report).encode("utf-8")
+        file_path = self._path(task_id, report_format, server)
+        temp_path = "{0}.{1}.tmp".format(file_path, uuid4().hex)
+        data = compress(data, self.compression_level)
+        with open(temp_path, "wb") as cache_file:
+            cache_file.write(data)
+        previous_size = 0
+        if path.exists(file_path):
+            previous_size = path.getsize(file_path)
+            remove(file_path)
+        rename(temp_path, file_path)
+        with self.lock:
+            if self.size is not None:
+                self.size += len(data) - previous_size
+            full = self.size is None or self.size > self.max_size
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used reports until the cache is 90% of max_size, and updates its size
+
+        Leaving some room means the next few reports can be added without listing the directory again."""
+        entries = []
+        for file_name in listdir(self.directory):
+            if not file_name.endswith(".z"):
+                continue
+            file_path = path.join(self.directory, file_name)
+            try:
+                entries.append((path.getmtime(file_path), path.getsize(file_path), file_path))
+            except OSError:
+                continue
+        entries.sort()
+        total_size = sum(entry[1] for entry in entries)
+        if total_size > self.max_size:
+            target_size = self.max_size * 0.9
+            while total_size > target_size and len(entries) > 0:
+                mtime, size, file_path = entries.pop(0)
+                try:
+                    remove(file_path)
+                except OSError:
+                    pass
+                total_size -= size
+        with self.lock:
+            self.size = total_size
+
+
+def _intern(value):
+    # Statuses, categories, and tags repeat across every task, so each distinct string is only stored once
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+
+def _tag_names(tags):
+    # Tags are listed as names, or as dicts with a name, depending on the version of Cuckoo
+    return tuple(_intern(tag["name"] if isinstance(tag, dict) else tag) for tag in tags or ())
+
+
+class Task(object):
+    """A compact record of a task, returned by Cuckoo methods called with records=True"""
+
+    __slots__ = ("id", "status", "category", "target", "tags", "machine", "package", "priority", "added_on",
+                 "started_on", "completed_on", "sample_id")
+
+    def __init__(self, id, status=None, category=None, target=None, tags=(), machine=None, package=None,
+                 priority=None, added_on=None, started_on=None, completed_on=None, sample_id=None):
+        self.id = id
+        self.status = _intern(status)
+        self.category = _intern(category)
+        self.target = target
+        self.tags = _tag_names(tags)
+        self.machine = _intern(machine)
+        self.package = _intern(package)
+        self.priority = priority
+        self.added_on = added_on
+        self.started_on = started_on
+        self.completed_on = completed_on
+        self.sample_id = sample_id
+
+    @classmethod
+    def from_dict(cls, task):
+        return cls(task["id"], status=_normalize_status(task.get("status")), category=task.get("category"),
+                   target=task.get("target"), tags=task.get("tags"), machine=task.get("machine"),
+                   package=task.get("package"), priority=task.get("priority"), added_on=task.get("added_on"),
+                   started_on=task.get("started_on"), completed_on=task.get("completed_on"),
+                   sample_id=task.get("sample_id"))
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return "Task(id={0!r}, status={1!r})".format(self.id, self.status)
+
+
+class Machine(object):
+    """A compact record of an analysis machine, returned by Cuckoo methods called with records=True"""
+
+    __slots__ = ("name", "label", "platform", "ip", "status", "locked", "tags")
+
+    def __init__(self, name, label=None, platform=None, ip=None, status=None, locked=False, tags=()):
+        self.name = name
+        self.label = label
+        self.platform = _intern(platform)
+        self.ip = ip
+        self.status = _intern(status)
+        self.locked = locked
+        self.tags = _tag_names(tags)
+
+    @classmethod
+    def from_dict(cls, machine):
+        return cls(machine["name"], label=machine.get("label"), platform=machine.get("platform"),
+                   ip=machine.get("ip"), status=machine.get("status"), locked=machine.get("locked", False),
+                   tags=machine.get("tags"))
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return "Machine(name={0!r}, status={1!r})".format(self.name, self.status)
+
+
+class IOCSummary(object):
+    """A compact summary of the IOCs of a task, returned by get_task_iocs with records=True"""
+
+    __slots__ = ("task_id", "malscore", "signatures", "hosts", "domains", "dropped")
+
+    def __init__(self, task_id, malscore=None, signatures=(), hosts=(), domains=(), dropped=()):
+        self.task_id = task_id
+        self.malscore = malscore
+        self.signatures = tuple(_intern(signature) for signature in signatures)
+        self.hosts = tuple(hosts)
+        self.domains = tuple(domains)
+        self.dropped = tuple(dropped)
+
+    @classmethod
+    def from_dict(cls, task_id, iocs):
+        network = iocs.get("network") or {}
+        return cls(task_id, malscore=iocs.get("malscore"), signatures=_ioc_values(iocs.get("signatures"), "name"),
+                   hosts=_ioc_values(network.get("hosts"), "ip"),
+                   domains=_ioc_values(network.get("domains"), "domain"),
+                   dropped=_ioc_values(iocs.get("dropped"), "sha256"))
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return "IOCSummary(task_id={0!r}, malscore={1!r})".format(self.task_id, self.malscore)
+
+
+class TaskTable(object):
+    """A columnar collection of the IDs, statuses, categories, and tags of many tasks
+
+    Columns are arrays, and statuses, categories, and tags are stored as small integer codes, so a task takes a few
+    bytes instead of a dict, and filtering by them does not compare strings. Other task fields are not kept."""
+
+    def __init__(self, tasks=()):
+        self.ids = array("l")
+        self.statuses = array("H")
+        self.categories = array("H")
+        self.tag_sets = array("H")
+        self._names = []
+        self._codes = {}
+        self.extend(tasks)
+
+    def _code(self, name):
+        # Names and tag sets share one table of codes
+        code = self._codes.get(name)
+        if code is None:
+            code = len(self._names)
+            self._names.append(_intern(name))
+            self._codes[name] = code
+        return code
+
+    def append(self, task):
+        """Adds a Task, or a task dict from the API"""
+        if isinstance(task, dict):
+            task = Task.from_dict(task)
+        self.ids.append(task.id)
+        self.statuses.append(self._code(task.status))
+        self.categories.append(self._code(task.category))
+        self.tag_sets.append(self._code(tuple(sorted(task.tags))))
+
+    def extend(self, tasks):
+        for task in tasks:
+            self.append(task)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        return Task(self.ids[row], status=self._names[self.statuses[row]],
+                    category=self._names[self.categories[row]], tags=self._names[self.tag_sets[row]])
+
+    def __iter__(self):
+        for row in range(len(self.ids)):
+            yield self[row]
+
+    def rows(self, status=None, category=None, tag=None):
+        """Returns the rows of the tasks with the given status, category, and tag"""
+        rows = range(len(self.ids))
+        for column, name in ((self.statuses, status), (self.categories, category)):
+            if name is None:
+                continue
+            code = self._codes.get(name)
+            if code is None:
+                return []
+            rows = [row for row in rows if column[row] == code]
+        if tag is not None:
+            codes = set(code for code, names in enumerate(self._names) if isinstance(names, tuple) and tag in names)
+            rows = [row for row in rows if self.tag_sets[row] in codes]
+        return list(rows)
+
+    def task_ids(self, status=None, category=None, tag=None):
+        return [self.ids[row] for row in self.rows(status=status, category=category, tag=tag)]
+
+    def filter(self, status=None, category=None, tag=None):
+        """Returns a new TaskTable of the tasks with the given status, category, and tag"""
+        return TaskTable(self[row] for row in self.rows(status=status, category=category, tag=tag))
+
+    def status_counts(self):
+        counts = {}
+        for code in self.statuses:
+            status = self._names[code]
+            counts[status] = counts.get(status, 0) + 1
+        return counts
 
 
 class Cuckoo(object):
     @staticmethod
     def raise_errors(response, *args, **kwargs):
         response.raise_for_status()
-        if response.headers.get("content-type").lower().startswith("application/json"):
+        if response.headers.get("content-type", "").lower().startswith("application/json"):
             results = response.json()
             if results["error"]:
                 raise RuntimeError(results["error_value"])
 
-    def __init__(self, cuckoo_root, username=None, password=None, verify=True, proxies=None):
+    @staticmethod
+    def _raise_for_status(response, *args, **kwargs):
+        # Used instead of raise_errors where reading the whole response body must be avoided
+        response.raise_for_status()
+
+    @staticmethod
+    def _raise_small_json_errors(response, max_size=65536):
+        # Streamed responses skip raise_errors, but Cuckoo still reports some errors as small JSON documents
+        content_type = response.headers.get("content-type", "").lower()
+        length = response.headers.get("content-length")
+        if not content_type.startswith("application/json") or length is None or int(length) > max_size:
+            return
+        results = response.json()
+        if isinstance(results, dict) and results.get("error"):
+            response.close()
+            raise RuntimeError(results.get("error_value"))
+
+    def __init__(self, cuckoo_root, username=None, password=None, verify=True, proxies=None, report_cache=None,
+                 pool_connections=10, pool_maxsize=10, keep_alive=True, retries=3, backoff_factor=0.5,
+                 rate_limits=None, timeout=None, stats=False):
+        """Rate limits are a dict of API endpoint prefix (such as tasks/create or tasks/status) to a TokenBucket or
+        a number of requests per second. GET requests that fail with a connection error, or a 502, 503, or 504
+        status, are retried with jittered exponential backoff. Submissions are never retried. If stats is True,
+        every response is recorded in a ClientStats instance, in the stats attribute."""
         self.root = cuckoo_root
         self.api_root = "{0}/api".format(self.root)
         self.username = username
@@ -66,10 +873,46 @@ class Cuckoo(object):
         self.session.verify = verify
         self.session.proxies = proxies
         self.session.hooks = dict(response=self.raise_errors)
+        self.stats = None
+        if stats:
+            self.enable_stats()
+        buckets = {}
+        for endpoint in rate_limits or {}:
+            bucket = rate_limits[endpoint]
+            if not isinstance(bucket, TokenBucket):
+                bucket = TokenBucket(bucket)
+            buckets[endpoint.strip("/")] = bucket
+        retry = _JitteredRetry(total=retries, backoff_factor=backoff_factor, status_forcelist=(502, 503, 504),
+                               raise_on_status=False)
+        adapter = _CuckooAdapter(timeout=timeout, rate_limits=buckets, pool_connections=pool_connections,
+                                 pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not keep_alive:
+            self.session.headers["connection"] = "close"
+        self.report_cache = report_cache
         if username or password:
             self.session.auth = (self.username, self.password)
 
-    def submit_file(self, file_name, file_to_upload, tags=None, options=None):
+    def enable_stats(self):
+        """Starts recording statistics about every response, and returns the ClientStats instance"""
+        if self.stats is None:
+            self.stats = ClientStats()
+            self.session.hooks = dict(response=[self.stats.record, self.raise_errors])
+        return self.stats
+
+    def _streaming_hooks(self):
+        hooks = [self._raise_for_status]
+        if self.stats is not None:
+            hooks.insert(0, self.stats.record)
+        return dict(response=hooks)
+
+    def submit_file(self, file_name, file_to_upload, tags=None, options=None, return_hash=False):
+        """Submits a file, given as bytes, a readable file object, or a path
+
+        File objects and paths are streamed, so the file is never held in memory. If return_hash is True, a tuple of
+        the task IDs and the SHA256 hash of the file (computed while it was uploaded) is returned. On Python 2, paths
+        must be unicode, because str is bytes."""
         if tags is None:
             tags = ""
         if options is None:
@@ -77,10 +920,24 @@ class Cuckoo(object):
 
         url = "{0}{1}".format(self.api_root, "/tasks/create/file/")
         data = dict(tags=tags, options=options)
-        files = dict(file=(file_name, file_to_upload))
-        response = self.session.post(url, files=files,
-                                     data=data)
-        return response.json()["data"]["task_ids"]
+        if isinstance(file_to_upload, bytes):
+            files = dict(file=(file_name, file_to_upload))
+            response = self.session.post(url, files=files,
+                                         data=data)
+            file_hash = sha256(file_to_upload).hexdigest()
+        elif hasattr(file_to_upload, "read"):
+            body = _MultipartUpload(data, "file", file_name, file_to_upload)
+            response = self.session.post(url, data=body if body.len is not None else iter(body),
+                                         headers={"content-type": body.content_type})
+            file_hash = body.hexdigest()
+        else:
+            with open(file_to_upload, "rb") as file_obj:
+                return self.submit_file(file_name, file_obj, tags=tags, options=options, return_hash=return_hash)
+
+        task_ids = response.json()["data"]["task_ids"]
+        if return_hash:
+            return task_ids, file_hash
+        return task_ids
 
     def submit_url(self, url, tags=None, options=None):
         if tags is None:
@@ -117,22 +974,148 @@ class Cuckoo(object):
 
         return results
 
+    def find_tasks_many(self, sample_hashes, index=None, max_workers=8):
+        """Returns a dict of sample hash to a list of task IDs, looking up many hashes concurrently
+
+        If a KnownSampleIndex is given, fresh entries are answered from it without touching the server, and the
+        results of every lookup are saved to it."""
+        sample_hashes = list(set(sample_hash.lower() for sample_hash in sample_hashes))
+        for sample_hash in sample_hashes:
+            get_hash_type(sample_hash)
+        results = {}
+        if index is not None:
+            results = index.lookup(sample_hashes)
+        missing = [sample_hash for sample_hash in sample_hashes if sample_hash not in results]
+        if len(missing) > 0:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                for sample_hash, task_ids in zip(missing, executor.map(self.find_tasks, missing)):
+                    results[sample_hash] = task_ids
+                    if index is not None:
+                        index.add(sample_hash, task_ids)
+            finally:
+                executor.shutdown()
+
+        return results
+
     def extended_search(self, options):
         return self.session.post("{0}/tasks/extendedsearch/".format(self.api_root), data=options).json()['data']
 
-    def list_tasks(self, limit=None, offset=None, window=None):
+    def list_tasks(self, limit=None, offset=None, window=None, records=False):
+        """Returns the API response, or with records, a TaskTable of the listed tasks"""
         url = "{0}/tasks/list/".format(self.api_root)
         if limit:
-            url += limit
-            if offset:
-                url += "/{0}/".format(offset)
+            url += "{0}/".format(limit)
+            if offset or window:
+                url += "{0}/".format(offset or 0)
                 if window:
-                    url += "/{0}/".format(window)
+                    url += "{0}/".format(window)
 
-        return self.session.get(url).json()
+        results = self.session.get(url).json()
+        if records:
+            results = TaskTable(results['data'])
+        return results
 
-    def view_task(self, task_id):
-        return self.session.get("{0}/tasks/view/{1}".format(self.api_root, task_id)).json()['data']
+    def get_task_statuses(self, limit=None, offset=None, window=None):
+        """Returns a dict of task ID to status for a whole page of tasks in one request"""
+        tasks = self.list_tasks(limit=limit, offset=offset, window=window)['data']
+        return dict((task['id'], _normalize_status(task['status'])) for task in tasks)
+
+    def watch_tasks(self, since_task_id=0, journal_path=None, interval=10, page_size=1000, max_pages=10,
+                    forget_after=6):
+        """Yields a (task_id, previous_state, current_state) tuple each time a task newer than since_task_id changes
+        state, forever
+
+        Every interval seconds, the states of all tasks are fetched a page of page_size tasks at a time, up to
+        max_pages pages, and compared to the last known states, so the number of requests does not grow with the
+        number of tasks being watched. Only unfinished tasks are tracked. since_task_id is moved up to just below the
+        lowest unfinished task, so only the IDs of tasks that finished after it started are kept, to avoid reporting
+        them twice. An unfinished task that is not listed for forget_after rounds in a row, such as one that was
+        deleted, is forgotten. The tracked states and since_task_id are saved to journal_path after each round, and
+        loaded from it in place of since_task_id, so a consumer can resume after a crash. The transitions of an
+        unsaved round are yielded again on resume."""
+        states = {}
+        finished = set()
+        missing = {}
+        if journal_path is not None:
+            journal = load_journal(journal_path)
+            if journal is not None:
+                since_task_id, states, finished = journal
+        while True:
+            snapshot = {}
+            complete = False
+            for page in range(max_pages):
+                tasks = self.list_tasks(limit=page_size, offset=page * page_size)['data']
+                for task in tasks:
+                    if task['id'] > since_task_id:
+                        snapshot[task['id']] = _normalize_status(task['status'])
+                # The API sorts tasks by completion time, not ID, so every page may hold watched tasks
+                if len(tasks) < page_size:
+                    complete = True
+                    break
+            changed = False
+            for task_id in sorted(snapshot):
+                if task_id in finished:
+                    continue
+                previous_state = states.get(task_id)
+                if snapshot[task_id] != previous_state:
+                    changed = True
+                    yield task_id, previous_state, snapshot[task_id]
+                missing.pop(task_id, None)
+                if TaskTracker.is_finished(snapshot[task_id]):
+                    states.pop(task_id, None)
+                    finished.add(task_id)
+                else:
+                    states[task_id] = snapshot[task_id]
+            for task_id in [task_id for task_id in states if task_id not in snapshot]:
+                # When every task was listed, a missing task has been deleted
+                missing[task_id] = missing.get(task_id, 0) + 1
+                if complete or missing[task_id] >= forget_after:
+                    del states[task_id]
+                    del missing[task_id]
+                    changed = True
+            if len(states) > 0:
+                floor = min(states) - 1
+            else:
+                floor = max(finished) if len(finished) > 0 else since_task_id
+            if floor > since_task_id:
+                since_task_id = floor
+                finished = set(task_id for task_id in finished if task_id > since_task_id)
+                changed = True
+            if changed and journal_path is not None:
+                save_journal(journal_path, since_task_id, states, finished)
+            sleep(interval)
+
+    def iter_tasks(self, page_size=100, offset=0, window=None, records=False):
+        """Lazily iterates over tasks, one page at a time, prefetching the next page in the background
+
+        The offset attribute of the returned iterable can be saved and passed back as offset to resume. With records,
+        Task records are yielded instead of dicts, and can be collected into a TaskTable."""
+        def fetch_page(limit, page_offset):
+            page = self.list_tasks(limit=limit, offset=page_offset, window=window)['data']
+            if records:
+                page = [Task.from_dict(task) for task in page]
+            return page
+
+        return _PagedResults(fetch_page, page_size, offset=offset)
+
+    def iter_search(self, options, page_size=100, offset=0):
+        """Lazily iterates over extended search results, like iter_tasks
+
+        limit and offset are sent with the search options. Servers that do not support them return every result
+        in the first page, which is then iterated over from offset."""
+        def fetch_page(limit, page_offset):
+            page_options = dict(options)
+            page_options.update(limit=limit, offset=page_offset)
+            return self.extended_search(page_options)
+
+        return _PagedResults(fetch_page, page_size, offset=offset)
+
+    def view_task(self, task_id, records=False):
+        results = self.session.get("{0}/tasks/view/{1}".format(self.api_root, task_id)).json()['data']
+        if records:
+            results = Task.from_dict(results)
+        return results
 
     def reschedule_task(self, task_id):
         return self.session.get("{0}/tasks/view/{1}".format(self.api_root, task_id)).json()['data']
@@ -142,57 +1125,361 @@ class Cuckoo(object):
 
     def get_task_status(self, task_id):
         status = self.session.get("{0}/tasks/status/{1}".format(self.api_root, task_id)).json()['data']
-        # Workaround the difference in status names in web API and UI
-        if status == "completed":
-            status = "processing"
-
-        return status
+        return _normalize_status(status)
 
     def get_task_report(self, task_id, report_format="json"):
-        response = self.session.get("{0}/tasks/get/report/{1}/{2}".format(self.api_root, task_id, report_format))
-        if report_format == "json":
-            results = response.json()['data']
-        elif report_format == "pdf":
-            results = BytesIO(response.content)
-        else:
-            results = response.content
+        results = None
+        if self.report_cache is not None:
+            results = self.report_cache.get(task_id, report_format, server=self.api_root)
+        if results is None:
+            response = self.session.get("{0}/tasks/get/report/{1}/{2}".format(self.api_root, task_id,
+                                                                              report_format))
+            if report_format == "json":
+                results = response.json()['data']
+            else:
+                results = response.content
+            if self.report_cache is not None:
+                self.report_cache.set(task_id, report_format, results, server=self.api_root)
+        if report_format == "pdf":
+            results = BytesIO(results)
 
         return results
 
-    def get_task_iocs(self, task_id, detailed=False):
+    def iter_task_report_fields(self, task_id, fields):
+        """Parses a JSON report as it is downloaded, and yields (field, value) tuples for only the requested fields
+
+        Fields are dotted paths into the report, such as signatures or network.hosts. Use item to select every
+        element of a list, such as dropped.item.sha256, in which case a tuple is yielded for each element. Memory use
+        is proportional to the size of the selected values, not the report. Requires ijson."""
+        if ijson is None:
+            raise ImportError("iter_task_report_fields requires ijson - https://pypi.python.org/pypi/ijson/")
+        prefixes = dict(("data.{0}".format(field), field) for field in fields)
+        url = "{0}/tasks/get/report/{1}/json".format(self.api_root, task_id)
+        response = self.session.get(url, stream=True, hooks=self._streaming_hooks())
+        response.raw.decode_content = True
+        error = False
+        error_value = None
+        builder = None
+        depth = 0
+        try:
+            for prefix, event, value in ijson.parse(response.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if event in ("start_map", "start_array"):
+                        depth += 1
+                    elif event in ("end_map", "end_array"):
+                        depth -= 1
+                        if depth == 0:
+                            yield field, builder.value
+                            builder = None
+                elif prefix in prefixes and event != "map_key" and event not in ("end_map", "end_array"):
+                    field = prefixes[prefix]
+                    if event in ("start_map", "start_array"):
+                        builder = ijson.ObjectBuilder()
+                        builder.event(event, value)
+                        depth = 1
+                    else:
+                        yield field, value
+                elif prefix == "error":
+                    error = value
+                elif prefix == "error_value":
+                    error_value = value
+                if error and error_value is not None:
+                    raise RuntimeError(error_value)
+        finally:
+            response.close()
+        if error:
+            raise RuntimeError(error_value)
+
+    def get_task_iocs(self, task_id, detailed=False, records=False):
         url = "{0}/tasks/get/iocs/{1}".format(self.api_root, task_id)
         if detailed:
             url += "/detailed/"
-        return self.session.get(url).json()['data']
+        results = self.session.get(url).json()['data']
+        if records:
+            results = IOCSummary.from_dict(task_id, results)
+        return results
+
+    def _task_artifact_url(self, artifact, task_id, item_id=None):
+        url = "{0}/tasks/get/{1}/{2}/".format(self.api_root, artifact, task_id)
+        if item_id:
+            url += "{0}/".format(item_id)
+        return url
+
+    def _iter_artifact(self, url, chunk_size=65536, offset=0):
+        headers = None
+        if offset:
+            headers = dict(range="bytes={0}-".format(offset))
+        response = self.session.get(url, headers=headers, stream=True, hooks=self._streaming_hooks())
+        self._raise_small_json_errors(response)
+        if offset and response.status_code != 206:
+            response.close()
+            raise ValueError("The server does not support resuming this download")
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield chunk
+        finally:
+            response.close()
+
+    @staticmethod
+    def _range_start(response):
+        # Returns the first byte offset of a 206 response's Content-Range, or None
+        content_range = response.headers.get("content-range", "")
+        try:
+            return int(content_range.split(" ", 1)[1].split("-", 1)[0])
+        except (IndexError, ValueError):
+            return None
+
+    def _download_artifact(self, url, file_path, hashes=None, resume=True, chunk_size=65536):
+        # The modification time of the file is set to the artifact's Last-Modified time, and sent back as If-Range
+        # when resuming, so the server only sends the rest of the artifact if the file holds the start of the same one
+        hashers = _new_hashers(hashes)
+        offset = 0
+        if resume and path.isfile(file_path):
+            offset = path.getsize(file_path)
+        headers = None
+        if offset:
+            headers = {"range": "bytes={0}-".format(offset),
+                       "if-range": formatdate(path.getmtime(file_path), usegmt=True)}
+        try:
+            response = self.session.get(url, headers=headers, stream=True, hooks=self._streaming_hooks())
+            self._raise_small_json_errors(response)
+        except HTTPError as e:
+            # The local file already holds every byte the server has
+            if offset and e.response is not None and e.response.status_code == 416:
+                response = None
+            else:
+                raise
+        if response is not None and response.status_code == 206 and self._range_start(response) != offset:
+            # The server sent some other part of the artifact, so download all of it
+            response.close()
+            response = self.session.get(url, stream=True, hooks=self._streaming_hooks())
+            self._raise_small_json_errors(response)
+        try:
+            if response is None or response.status_code == 206:
+                mode = "r+b"
+            else:
+                # The server ignored the range, so start over
+                mode = "wb"
+                offset = 0
+            with open(file_path, mode) as output_file:
+                if hashers and offset:
+                    buffer = output_file.read(chunk_size)
+                    while len(buffer) > 0:
+                        for hasher in hashers.values():
+                            hasher.update(buffer)
+                        buffer = output_file.read(chunk_size)
+                output_file.seek(offset)
+                output_file.truncate()
+                if response is not None:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        output_file.write(chunk)
+                        for hasher in hashers.values():
+                            hasher.update(chunk)
+                size = output_file.tell()
+        finally:
+            if response is not None:
+                response.close()
+                last_modified = parsedate_tz(response.headers.get("last-modified", ""))
+                if last_modified is not None and path.isfile(file_path):
+                    timestamp = mktime_tz(last_modified)
+                    utime(file_path, (timestamp, timestamp))
+
+        return dict(path=file_path, size=size,
+                    hashes=dict((hash_type, hashers[hash_type].hexdigest()) for hash_type in hashers))
 
     def get_task_screenshots(self, task_id, screenshot_id=None):
-        url = "{0}/tasks/get/screenshot/{1}/".format(self.api_root, task_id)
-        if screenshot_id:
-            url += "{0}/".format(screenshot_id)
+        url = self._task_artifact_url("screenshot", task_id, screenshot_id)
         return BytesIO(self.session.get(url).content)
 
     def get_task_procmemory(self, task_id, pid=None):
-        url = "{0}/tasks/get/procmemory/{1}/".format(self.api_root, task_id)
-        if pid:
-            url += "{0}/".format(pid)
+        url = self._task_artifact_url("procmemory", task_id, pid)
         return BytesIO(self.session.get(url).content)
 
+    def iter_task_procmemory(self, task_id, pid=None, chunk_size=65536, offset=0):
+        return self._iter_artifact(self._task_artifact_url("procmemory", task_id, pid),
+                                   chunk_size=chunk_size, offset=offset)
+
+    def download_task_procmemory(self, task_id, file_path, pid=None, hashes=None, resume=True):
+        return self._download_artifact(self._task_artifact_url("procmemory", task_id, pid), file_path,
+                                       hashes=hashes, resume=resume)
+
     def get_task_fullmemory(self, task_id):
-        url = "{0}/tasks/get/fullmemory/{1}/".format(self.api_root, task_id)
+        url = self._task_artifact_url("fullmemory", task_id)
         return BytesIO(self.session.get(url).content)
 
+    def iter_task_fullmemory(self, task_id, chunk_size=65536, offset=0):
+        return self._iter_artifact(self._task_artifact_url("fullmemory", task_id),
+                                   chunk_size=chunk_size, offset=offset)
+
+    def download_task_fullmemory(self, task_id, file_path, hashes=None, resume=True):
+        return self._download_artifact(self._task_artifact_url("fullmemory", task_id), file_path,
+                                       hashes=hashes, resume=resume)
+
     def get_task_pcap(self, task_id):
-        url = "{0}/tasks/get/pcap/{1}/".format(self.api_root, task_id)
+        url = self._task_artifact_url("pcap", task_id)
         return BytesIO(self.session.get(url).content)
 
+    def iter_task_pcap(self, task_id, chunk_size=65536, offset=0):
+        return self._iter_artifact(self._task_artifact_url("pcap", task_id),
+                                   chunk_size=chunk_size, offset=offset)
+
+    def download_task_pcap(self, task_id, file_path, hashes=None, resume=True):
+        return self._download_artifact(self._task_artifact_url("pcap", task_id), file_path,
+                                       hashes=hashes, resume=resume)
+
     def get_task_dropped_files(self, task_id):
-        url = "{0}/tasks/get/sropped/{1}/".format(self.api_root, task_id)
+        url = self._task_artifact_url("dropped", task_id)
         return BytesIO(self.session.get(url).content)
 
+    def iter_task_dropped_files(self, task_id, chunk_size=65536, offset=0):
+        return self._iter_artifact(self._task_artifact_url("dropped", task_id),
+                                   chunk_size=chunk_size, offset=offset)
+
+    def download_task_dropped_files(self, task_id, file_path, hashes=None, resume=True):
+        return self._download_artifact(self._task_artifact_url("dropped", task_id), file_path,
+                                       hashes=hashes, resume=resume)
+
     def get_task_suri_files(self, task_id):
-        url = "{0}/tasks/get/surifile/{1}/".format(self.api_root, task_id)
+        url = self._task_artifact_url("surifile", task_id)
         return BytesIO(self.session.get(url).content)
 
+    def iter_task_suri_files(self, task_id, chunk_size=65536, offset=0):
+        return self._iter_artifact(self._task_artifact_url("surifile", task_id),
+                                   chunk_size=chunk_size, offset=offset)
+
+    def download_task_suri_files(self, task_id, file_path, hashes=None, resume=True):
+        return self._download_artifact(self._task_artifact_url("surifile", task_id), file_path,
+                                       hashes=hashes, resume=resume)
+
+    def fetch_task_bundle(self, task_ids, artifacts=("report", "pcap", "screenshot", "dropped"), dest=".",
+                          archive_format=None, max_workers=8, verify=False, spool_size=16777216, callback=None):
+        """Downloads artifacts of many tasks concurrently, and returns a list of dicts describing each transfer
+
+        Without an archive_format, artifacts are streamed straight to dest/<task ID>/, and a manifest.json of their
+        sizes and SHA256 hashes is kept in each task directory. Artifacts listed in the manifest are skipped if
+        their size still matches, or, with verify, their hash. Partial downloads are resumed. With an
+        archive_format of tar or zip, dest is an archive that artifacts are added to, and artifacts already in it
+        are skipped. An archive can only be written one member at a time, so each artifact is spooled to a
+        temporary file first, in memory up to spool_size bytes. Streaming into zip archives requires Python 3.6
+        or later. Each dict holds the task_id, artifact, path, size, seconds, and rate in bytes per second, plus
+        skipped or error. callback is called with each dict as its transfer finishes."""
+        for artifact in artifacts:
+            if artifact not in bundle_artifacts:
+                raise ValueError("Invalid artifact {0}".format(artifact))
+        if archive_format not in (None, "tar", "zip"):
+            raise ValueError("Invalid archive format")
+        lock = Lock()
+        manifests = {}
+        archive = None
+        members = set()
+        if archive_format == "tar":
+            archive = tarfile.open(dest, "a")
+            members = set(archive.getnames())
+        elif archive_format == "zip":
+            archive = zipfile.ZipFile(dest, "a", allowZip64=True)
+            members = set(archive.namelist())
+        else:
+            for task_id in task_ids:
+                task_directory = path.join(dest, str(task_id))
+                if not path.isdir(task_directory):
+                    makedirs(task_directory)
+                try:
+                    with open(path.join(task_directory, "manifest.json")) as manifest_file:
+                        manifests[task_id] = json.load(manifest_file)
+                except (IOError, OSError, ValueError):
+                    manifests[task_id] = {}
+
+        def artifact_url(artifact, task_id):
+            if artifact == "report":
+                return "{0}/tasks/get/report/{1}/json".format(self.api_root, task_id)
+            return self._task_artifact_url(artifact, task_id)
+
+        def is_present(task_id, artifact, file_path):
+            if archive is not None:
+                return file_path in members
+            entry = manifests[task_id].get(bundle_artifacts[artifact])
+            if entry is None or not path.isfile(file_path) or path.getsize(file_path) != entry["size"]:
+                return False
+            if verify:
+                with open(file_path, "rb") as artifact_file:
+                    return get_file_hash(artifact_file) == entry["sha256"]
+            return True
+
+        def save_manifest(task_id, file_name, result):
+            with lock:
+                manifest = manifests[task_id]
+                manifest[file_name] = dict(size=result["size"], sha256=result["hashes"]["sha256"])
+                manifest_path = path.join(dest, str(task_id), "manifest.json")
+                temp_path = "{0}.tmp".format(manifest_path)
+                with open(temp_path, "w") as manifest_file:
+                    json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+                if path.exists(manifest_path):
+                    remove(manifest_path)
+                rename(temp_path, manifest_path)
+
+        def add_member(name, spool):
+            size = spool.tell()
+            spool.seek(0)
+            with lock:
+                if archive_format == "tar":
+                    member = tarfile.TarInfo(name)
+                    member.size = size
+                    member.mtime = time()
+                    archive.addfile(member, spool)
+                else:
+                    with archive.open(name, "w", force_zip64=True) as member:
+                        copyfileobj(spool, member)
+                members.add(name)
+            return size
+
+        def fetch(task_id, artifact):
+            file_name = bundle_artifacts[artifact]
+            if archive is None:
+                file_path = path.join(dest, str(task_id), file_name)
+            else:
+                file_path = "{0}/{1}".format(task_id, file_name)
+            result = dict(task_id=task_id, artifact=artifact, path=file_path, size=0, seconds=0, rate=0)
+            if is_present(task_id, artifact, file_path):
+                result["skipped"] = True
+                return result
+            start_time = time()
+            try:
+                if archive is None:
+                    download = self._download_artifact(artifact_url(artifact, task_id), file_path, hashes=("sha256",))
+                    save_manifest(task_id, file_name, download)
+                    result["size"] = download["size"]
+                else:
+                    with SpooledTemporaryFile(max_size=spool_size) as spool:
+                        for chunk in self._iter_artifact(artifact_url(artifact, task_id)):
+                            spool.write(chunk)
+                        result["size"] = add_member(file_path, spool)
+            except (HTTPError, RuntimeError, IOError, OSError, ValueError) as e:
+                result["error"] = str(e)
+            result["seconds"] = time() - start_time
+            if result["seconds"] > 0:
+                result["rate"] = result["size"] / result["seconds"]
+            return result
+
+        results = []
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [executor.submit(fetch, task_id, artifact) for task_id in task_ids for artifact in artifacts]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+        finally:
+            executor.shutdown()
+            if archive is not None:
+                archive.close()
+
+        return results
+
     def view_file(self, file_hash):
         hash_type = get_hash_type(file_hash)
         return self.session.get("{0}/files/view/{1/{2}}".format(self.api_root, hash_type, file_hash).json())
@@ -203,11 +1490,537 @@ class Cuckoo(object):
         results = results["data"]
         return results
 
-    def list_machines(self):
-        return self.session.get("{0}/machines/list/".format(self.api_root).json())['data']
+    def list_machines(self, records=False):
+        results = self.session.get("{0}/machines/list/".format(self.api_root)).json()['data']
+        if records:
+            results = [Machine.from_dict(machine) for machine in results]
+        return results
 
-    def view_machine(self, machine_name):
-        return self.session.get("{0}/machines/view/{1}/".format(self.api_root, machine_name).json())['data']
+    def view_machine(self, machine_name, records=False):
+        results = self.session.get("{0}/machines/view/{1}/".format(self.api_root, machine_name)).json()['data']
+        if records:
+            results = Machine.from_dict(results)
+        return results
 
     def get_cuckoo_status(self):
-        return self.session.get("{0}/cuckoo/status/".format(self.api_root).json())['data']
+        return self.session.get("{0}/cuckoo/status/".format(self.api_root)).json()['data']
+
+
+class _TrackedTask(object):
+    __slots__ = ("state", "next_poll")
+
+    def __init__(self):
+        self.state = None
+        self.next_poll = 0
+
+
+class TaskTracker(object):
+    """Tracks the state of many tasks, calling callbacks as their states change
+
+    Statuses are fetched for a whole page of tasks at once, and each task is only polled again once its state's
+    interval in poll_intervals has passed. Tasks that are not on the page are polled individually.
+
+    Batching depends on how the server orders /tasks/list/: Cuckoo lists tasks by completion time, so pending and
+    running tasks sort after every completed one and fall off the page on busy servers. When a page matches none of
+    the due tasks, the page is skipped for the next batch_retry polls, so a miss costs at most one extra request."""
+
+    poll_intervals = {None: 1, "pending": 30, "running": 5, "processing": 10}
+
+    def __init__(self, cuckoo, task_ids=None, callbacks=None, poll_intervals=None, batch_size=100, batch_retry=10):
+        self.cuckoo = cuckoo
+        self.callbacks = list(callbacks or [])
+        self.poll_intervals = dict(self.poll_intervals)
+        if poll_intervals:
+            self.poll_intervals.update(poll_intervals)
+        self.batch_size = batch_size
+        self.batch_retry = batch_retry
+        self._skip_batches = 0
+        self.tasks = {}
+        for task_id in task_ids or []:
+            self.track(task_id)
+
+    @staticmethod
+    def is_finished(state):
+        return state is not None and (state == "reported" or state.startswith("failed"))
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def track(self, task_id):
+        if task_id not in self.tasks:
+            self.tasks[task_id] = _TrackedTask()
+
+    def _interval(self, state):
+        return self.poll_intervals.get(state, self.poll_intervals[None])
+
+    def poll(self):
+        """Polls every task that is due, and returns a list of (task_id, previous_state, current_state) changes"""
+        now = time()
+        due = [task_id for task_id in self.tasks if self.tasks[task_id].next_poll <= now]
+        statuses = {}
+        if len(due) > 1 and self._skip_batches > 0:
+            self._skip_batches -= 1
+        elif len(due) > 1:
+            statuses = self.cuckoo.get_task_statuses(limit=max(self.batch_size, len(due)))
+            if not any(task_id in statuses for task_id in due):
+                self._skip_batches = self.batch_retry
+        changes = []
+        for task_id in due:
+            if task_id in statuses:
+                state = statuses[task_id]
+            else:
+                state = self.cuckoo.get_task_status(task_id)
+            task = self.tasks[task_id]
+            previous_state = task.state
+            task.state = _intern(state)
+            task.next_poll = time() + self._interval(state)
+            if state != previous_state:
+                changes.append((task_id, previous_state, state))
+                for callback in self.callbacks:
+                    callback(task_id, previous_state, state)
+            if self.is_finished(state):
+                del self.tasks[task_id]
+
+        return changes
+
+    def events(self):
+        """Yields (task_id, previous_state, current_state) changes until every task is finished"""
+        while len(self.tasks) > 0:
+            for change in self.poll():
+                yield change
+            if len(self.tasks) > 0:
+                next_poll = min(task.next_poll for task in self.tasks.values())
+                sleep(max(next_poll - time(), 0))
+
+    def run(self):
+        for _ in self.events():
+            pass
+
+
+def _ordered_map(executor, function, iterable, window):
+    # Like Executor.map, but with at most window calls queued, so huge iterables are never all in memory at once
+    futures = deque()
+    for item in iterable:
+        futures.append((item, executor.submit(function, item)))
+        if len(futures) >= window:
+            item, future = futures.popleft()
+            yield item, future
+    while len(futures) > 0:
+        yield futures.popleft()
+
+
+def _ioc_values(value, key=None):
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        value = [value]
+    values = []
+    for item in value:
+        if isinstance(item, dict):
+            item = item.get(key) if key else None
+        if item is not None and not isinstance(item, (dict, list)):
+            values.append(item)
+    return values
+
+
+def normalize_iocs(task_id, iocs):
+    """Flattens the IOCs of a task from get_task_iocs into a list of dicts with task_id, type, and value keys"""
+    records = []
+    network = iocs.get("network") or {}
+    behavior = dict(files=iocs.get("files") or {}, registry=iocs.get("registry") or {})
+    sources = [
+        ("signature", _ioc_values(iocs.get("signatures"), "name")),
+        ("ip", _ioc_values(network.get("hosts"), "ip")),
+        ("domain", _ioc_values(network.get("domains"), "domain")),
+        ("domain", list((network.get("traffic") or {}).get("http") or {})),
+        ("mutex", _ioc_values(iocs.get("mutexes"))),
+        ("command", _ioc_values(iocs.get("executed_commands"))),
+        ("file", _ioc_values(behavior["files"].get("write"))),
+        ("file", _ioc_values(behavior["files"].get("delete"))),
+        ("registry", _ioc_values(behavior["registry"].get("write"))),
+        ("registry", _ioc_values(behavior["registry"].get("delete"))),
+        ("sha256", _ioc_values(iocs.get("dropped"), "sha256")),
+    ]
+    for ioc_type, values in sources:
+        for value in values:
+            value = "{0}".format(value).strip()
+            if ioc_type == "domain":
+                value = value.lower().rstrip(".")
+            elif ioc_type == "sha256":
+                value = value.lower()
+            if len(value) > 0:
+                records.append(dict(task_id=task_id, type=ioc_type, value=value))
+
+    return records
+
+
+def export_iocs(cuckoo, task_ids, output, output_format="ndjson", checkpoint_path=None, max_workers=8,
+                errors=None, header=True):
+    """Fetches the detailed IOCs of many tasks concurrently, and writes each unique IOC to output as newline
+    delimited JSON or CSV
+
+    Tasks are written in the order given. After each one, the highest ID written is saved to checkpoint_path, so a
+    later run can continue after it. Tasks whose IOCs cannot be fetched are skipped, and added to the errors list, if
+    one is given, and to the failed task IDs in the checkpoint, so a later run can retry them. Returns the number of
+    IOCs written."""
+    if output_format not in ("ndjson", "csv"):
+        raise ValueError("Invalid output format")
+    writer = None
+    if output_format == "csv":
+        writer = csv.DictWriter(output, fieldnames=("task_id", "type", "value"))
+        if header:
+            writer.writeheader()
+    seen = set()
+    written = 0
+    task_ids = list(task_ids)
+    last_task_id = None
+    failed_task_ids = []
+    if checkpoint_path is not None:
+        last_task_id = load_checkpoint(checkpoint_path)
+        # Earlier failures stay in the checkpoint until they are retried
+        retried = set(task_ids)
+        failed_task_ids = [task_id for task_id in load_failed_task_ids(checkpoint_path) if task_id not in retried]
+
+    def fetch(task_id):
+        return normalize_iocs(task_id, cuckoo.get_task_iocs(task_id, detailed=True))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for task_id, future in _ordered_map(executor, fetch, task_ids, max_workers * 2):
+            try:
+                records = future.result()
+            except (RequestException, RuntimeError, ValueError) as e:
+                if errors is not None:
+                    errors.append((task_id, e))
+                failed_task_ids.append(task_id)
+                records = []
+            for record in records:
+                key = (record["type"], record["value"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                if writer is not None:
+                    writer.writerow(record)
+                else:
+                    output.write(json.dumps(record) + "\n")
+                written += 1
+            output.flush()
+            if checkpoint_path is not None:
+                last_task_id = task_id if last_task_id is None else max(last_task_id, task_id)
+                save_checkpoint(checkpoint_path, last_task_id, failed_task_ids)
+    finally:
+        executor.shutdown()
+
+    return written
+
+
+def load_checkpoint(checkpoint_path):
+    """Returns the last task ID saved to a checkpoint file, or None"""
+    try:
+        with open(checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)["last_task_id"]
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def load_failed_task_ids(checkpoint_path):
+    """Returns the IDs of tasks whose IOCs could not be exported, saved to a checkpoint file"""
+    try:
+        with open(checkpoint_path) as checkpoint_file:
+            return list(json.load(checkpoint_file).get("failed_task_ids", []))
+    except (IOError, OSError, ValueError, AttributeError):
+        return []
+
+
+def save_checkpoint(checkpoint_path, task_id, failed_task_ids=()):
+    temp_path = "{0}.tmp".format(checkpoint_path)
+    with open(temp_path, "w") as checkpoint_file:
+        json.dump(dict(last_task_id=task_id, failed_task_ids=sorted(set(failed_task_ids))), checkpoint_file)
+    if path.exists(checkpoint_path):
+        remove(checkpoint_path)
+    rename(temp_path, checkpoint_path)
+
+
+def load_journal(journal_path):
+    """Returns the since_task_id, dict of unfinished task ID to state, and set of finished task IDs saved by
+    Cuckoo.watch_tasks, or None"""
+    try:
+        with open(journal_path) as journal_file:
+            journal = json.load(journal_file)
+        states = dict((int(task_id), state) for task_id, state in journal["states"].items())
+        finished = set(journal.get("finished", []))
+        # Journals from earlier versions kept finished tasks with the unfinished ones
+        for task_id in [task_id for task_id in states if TaskTracker.is_finished(states[task_id])]:
+            finished.add(task_id)
+            del states[task_id]
+        return journal["since_task_id"], states, finished
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def save_journal(journal_path, since_task_id, states, finished=()):
+    temp_path = "{0}.tmp".format(journal_path)
+    with open(temp_path, "w") as journal_file:
+        json.dump(dict(since_task_id=since_task_id, states=states, finished=sorted(finished)), journal_file,
+                  separators=(",", ":"))
+    if path.exists(journal_path):
+        remove(journal_path)
+    rename(temp_path, journal_path)
+
+
+class SubmissionScheduler(object):
+    """Submits files and URLs in priority order, while keeping the number of pending Cuckoo tasks below max_pending
+
+    Each submission can be given a list of acceptable VM tags, in which case it is routed to the one with the most
+    unlocked machines, and waits while none of them have any. Cuckoo and machine statuses are cached for
+    status_ttl seconds."""
+
+    def __init__(self, cuckoo, max_pending=50, status_ttl=5):
+        self.cuckoo = cuckoo
+        self.max_pending = max_pending
+        self.status_ttl = status_ttl
+        self.lock = Lock()
+        self.queue = []
+        self._sequence = count()
+        self._status_updated = 0
+        self._capacity = 0
+        self._free_machines = {}
+        self.submitted = 0
+        self.failed = 0
+        self.started = time()
+        self._queue_wait_total = 0.0
+        self.max_queue_wait = 0.0
+
+    def _enqueue(self, submission, priority, tags, callback):
+        if tags is not None and not isinstance(tags, (list, tuple)):
+            tags = [tags]
+        submission.update(priority=priority, tags=tags, callback=callback, enqueued=time())
+        with self.lock:
+            heappush(self.queue, (-priority, next(self._sequence), submission))
+
+    def submit_file(self, file_name, file_to_upload, priority=0, tags=None, options=None, callback=None):
+        """Queues a file for submission. Higher priorities are submitted first. tags is a tag, or a list of
+        acceptable tags. callback is called with the file name and the task IDs, or the exception raised."""
+        self._enqueue(dict(kind="file", name=file_name, target=file_to_upload, options=options), priority, tags,
+                      callback)
+
+    def submit_url(self, url, priority=0, tags=None, options=None, callback=None):
+        """Queues a URL for submission, like submit_file"""
+        self._enqueue(dict(kind="url", name=url, target=url, options=options), priority, tags, callback)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def _refresh_status(self):
+        with self.lock:
+            if time() - self._status_updated < self.status_ttl:
+                return
+        # Fetched without holding the lock, so queueing submissions does not wait on Cuckoo
+        pending = self.cuckoo.get_cuckoo_status()["tasks"]["pending"]
+        free_machines = {}
+        for machine in self.cuckoo.list_machines():
+            if machine.get("locked"):
+                continue
+            for tag in machine.get("tags") or []:
+                if isinstance(tag, dict):
+                    tag = tag.get("name")
+                free_machines[tag] = free_machines.get(tag, 0) + 1
+        with self.lock:
+            self._capacity = self.max_pending - pending
+            self._free_machines = free_machines
+            self._status_updated = time()
+
+    def _route(self, tags):
+        if tags is None:
+            return None
+        free_tags = [tag for tag in tags if self._free_machines.get(tag, 0) > 0]
+        if len(free_tags) == 0:
+            return False
+        return max(free_tags, key=lambda tag: self._free_machines[tag])
+
+    def run_once(self):
+        """Submits as many queued submissions as the server has capacity for, and returns the number submitted"""
+        self._refresh_status()
+        with self.lock:
+            ready = []
+            waiting = []
+            while len(self.queue) > 0 and self._capacity > 0:
+                item = heappop(self.queue)
+                tag = self._route(item[2]["tags"])
+                if tag is False:
+                    waiting.append(item)
+                    continue
+                if tag is not None:
+                    self._free_machines[tag] -= 1
+                self._capacity -= 1
+                ready.append((item[2], tag))
+            for item in waiting:
+                heappush(self.queue, item)
+
+        sent = 0
+        try:
+            for submission, tag in ready:
+                sent += 1
+                try:
+                    if submission["kind"] == "file":
+                        task_ids = self.cuckoo.submit_file(submission["name"], submission["target"], tags=tag,
+                                                           options=submission["options"])
+                    else:
+                        task_ids = self.cuckoo.submit_url(submission["target"], tags=tag,
+                                                          options=submission["options"])
+                except (RequestException, IOError, RuntimeError) as e:
+                    self.failed += 1
+                    if submission["callback"] is not None:
+                        submission["callback"](submission["name"], e)
+                    continue
+                queue_wait = time() - submission["enqueued"]
+                self.submitted += 1
+                self._queue_wait_total += queue_wait
+                self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+                if submission["callback"] is not None:
+                    submission["callback"](submission["name"], task_ids)
+        finally:
+            if sent < len(ready):
+                # Something else was raised, such as by a callback, so queue the submissions that were not sent again
+                with self.lock:
+                    for submission, tag in ready[sent:]:
+                        heappush(self.queue, (-submission["priority"], next(self._sequence), submission))
+
+        return len(ready)
+
+    def run(self):
+        """Submits everything in the queue, waiting for capacity as needed"""
+        while len(self.queue) > 0:
+            if self.run_once() == 0:
+                sleep(self.status_ttl)
+
+    def metrics(self):
+        elapsed = max(time() - self.started, 0.001)
+        return dict(queued=len(self.queue), submitted=self.submitted, failed=self.failed,
+                    submissions_per_second=self.submitted / elapsed,
+                    mean_queue_wait=self._queue_wait_total / self.submitted if self.submitted else 0.0,
+                    max_queue_wait=self.max_queue_wait)
+
+
+class CuckooCluster(object):
+    """Spreads submissions across several Cuckoo nodes, and routes task calls to the node that owns the task
+
+    nodes is a dict of node name to Cuckoo instance, or a list of Cuckoo instances, which are named by their root
+    URLs. Task IDs are only unique within a node, so tasks are referred to by (node name, task ID) tuples. A node
+    that cannot be reached, or answers with a server error, is skipped for down_time seconds."""
+
+    def __init__(self, nodes, status_ttl=5, down_time=60):
+        if not isinstance(nodes, dict):
+            nodes = dict((node.root, node) for node in nodes)
+        self.nodes = nodes
+        self.status_ttl = status_ttl
+        self.down_time = down_time
+        self.lock = Lock()
+        self._down_until = {}
+        self._pending = {}
+        self._status_updated = 0
+
+    def available_nodes(self):
+        now = time()
+        return [name for name in sorted(self.nodes) if self._down_until.get(name, 0) <= now]
+
+    def _mark_down(self, name):
+        with self.lock:
+            self._down_until[name] = time() + self.down_time
+            self._status_updated = 0
+
+    @staticmethod
+    def _node_failed(error):
+        # Server errors mean the node is down or overloaded, but client errors are the caller's to handle
+        if isinstance(error, HTTPError):
+            return error.response is None or error.response.status_code >= 500
+        return isinstance(error, (RequestsConnectionError, Timeout))
+
+    def _map_nodes(self, function, names=None):
+        # Calls function(name) for each node concurrently, and returns a dict of the results from nodes that
+        # could be reached
+        names = self.available_nodes() if names is None else names
+        results = {}
+        if len(names) == 0:
+            return results
+        executor = ThreadPoolExecutor(max_workers=len(names))
+        try:
+            futures = dict((name, executor.submit(function, name)) for name in names)
+            for name in futures:
+                try:
+                    results[name] = futures[name].result()
+                except (RequestsConnectionError, Timeout, HTTPError) as e:
+                    if not self._node_failed(e):
+                        raise
+                    self._mark_down(name)
+        finally:
+            executor.shutdown()
+
+        return results
+
+    def queue_depths(self):
+        """Returns a dict of node name to the number of pending tasks, for nodes that are up"""
+        with self.lock:
+            stale = time() - self._status_updated >= self.status_ttl
+        if stale:
+            pending = self._map_nodes(lambda name: self.nodes[name].get_cuckoo_status()["tasks"]["pending"])
+            with self.lock:
+                self._pending = pending
+                self._status_updated = time()
+        with self.lock:
+            return dict((name, self._pending[name]) for name in self.available_nodes() if name in self._pending)
+
+    def _submit(self, function):
+        while True:
+            depths = self.queue_depths()
+            if len(depths) == 0:
+                raise RuntimeError("No Cuckoo nodes are available")
+            name = min(depths, key=lambda node_name: depths[node_name])
+            with self.lock:
+                # Count the submission, so concurrent submissions spread out before the next status update
+                self._pending[name] = self._pending.get(name, 0) + 1
+            try:
+                return [(name, task_id) for task_id in function(self.nodes[name])]
+            except (RequestsConnectionError, Timeout, HTTPError) as e:
+                if not self._node_failed(e):
+                    raise
+                self._mark_down(name)
+
+    def submit_file(self, file_name, file_to_upload, tags=None, options=None):
+        """Submits a file to the node with the fewest pending tasks, and returns a list of (node, task ID) tuples"""
+        start = file_to_upload.tell() if hasattr(file_to_upload, "tell") else None
+
+        def submit(node):
+            if start is not None:
+                # Rewind, in case a previous attempt on a node that went down read part of the file
+                file_to_upload.seek(start)
+            return node.submit_file(file_name, file_to_upload, tags=tags, options=options)
+
+        return self._submit(submit)
+
+    def submit_url(self, url, tags=None, options=None):
+        """Submits a URL to the node with the fewest pending tasks, and returns a list of (node, task ID) tuples"""
+        return self._submit(lambda node: node.submit_url(url, tags=tags, options=options))
+
+    def find_tasks(self, sample_hash):
+        """Searches every node concurrently, and returns a list of (node, task ID) tuples"""
+        results = self._map_nodes(lambda name: self.nodes[name].find_tasks(sample_hash))
+        return [(name, task_id) for name in sorted(results) for task_id in results[name]]
+
+    def node(self, task):
+        return self.nodes[task[0]]
+
+    def view_task(self, task):
+        return self.node(task).view_task(task[1])
+
+    def delete_task(self, task):
+        return self.node(task).delete_task(task[1])
+
+    def get_task_status(self, task):
+        return self.node(task).get_task_status(task[1])
+
+    def get_task_report(self, task, report_format="json"):
+        return self.node(task).get_task_report(task[1], report_format=report_format)
+
+    def get_task_iocs(self, task, detailed=False):
+        return self.node(task).get_task_iocs(task[1], detailed=detailed)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Exports the IOCs of many Cuckoo tasks as newline delimited JSON or CSV"""
+
+from argparse import ArgumentParser
+from atexit import register
+from sys import stderr, stdout
+
+from cuckoocli import get_cuckoo
+from cuckooutils import TaskTracker, export_iocs, load_checkpoint, load_failed_task_ids
+
+__version__ = "1.0.0"
+__license__ = """Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+cuckoo = get_cuckoo()
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("-v", "--version", action="version", version=__version__)
+parser.add_argument("--first", type=int, help="The first task ID to export")
+parser.add_argument("--last", type=int, help="The last task ID to export")
+parser.add_argument("--limit", type=int, default=1000,
+                    help="Without --last, the number of recent tasks to list and export. Default: 1000")
+parser.add_argument("--window", type=int,
+                    help="Without --last, only export tasks completed in this many minutes")
+parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson",
+                    help="The output format. Default: ndjson")
+parser.add_argument("--output", help="The file to write to. Default: standard output")
+parser.add_argument("--checkpoint",
+                    help="A file for the last exported task ID, so the next run only exports newer tasks")
+parser.add_argument("--workers", type=int, default=8,
+                    help="The number of IOCs to fetch at once. Default: 8")
+parser.add_argument("--stats", action="store_true",
+                    help="Print statistics about the requests made to Cuckoo on exit")
+
+args = parser.parse_args()
+
+if args.stats:
+    stats = cuckoo.enable_stats()
+    register(lambda: stderr.write(stats.summary()))
+
+first = args.first
+if args.checkpoint:
+    last_task_id = load_checkpoint(args.checkpoint)
+    if last_task_id is not None:
+        first = max(first or 0, last_task_id + 1)
+
+if args.last:
+    task_ids = range(first or 1, args.last + 1)
+else:
+    # Listed tasks are filtered to reported ones, so the checkpoint never skips tasks that are still running
+    tasks = cuckoo.list_tasks(limit=args.limit, window=args.window)['data']
+    task_ids = sorted(task['id'] for task in tasks
+                      if task['status'] == "reported" and task['id'] >= (first or 0))
+    # Failed tasks have no IOCs, but will never be reported, so only tasks that are still being analyzed hold back
+    not_ready = [task['id'] for task in tasks
+                 if not TaskTracker.is_finished(task['status']) and task['id'] >= (first or 0)]
+    if len(not_ready) > 0:
+        # Stop before the oldest unfinished task, so it is exported by a later run
+        task_ids = [task_id for task_id in task_ids if task_id < min(not_ready)]
+
+if args.checkpoint:
+    # Retry tasks whose IOCs could not be fetched by an earlier run
+    failed_task_ids = [task_id for task_id in load_failed_task_ids(args.checkpoint) if task_id not in task_ids]
+    task_ids = failed_task_ids + list(task_ids)
+
+output = stdout
+header = True
+if args.output:
+    output = open(args.output, "a" if args.checkpoint else "w")
+    header = output.tell() == 0
+
+errors = []
+written = export_iocs(cuckoo, task_ids, output, output_format=args.format, checkpoint_path=args.checkpoint,
+                      max_workers=args.workers, errors=errors, header=header)
+for task_id, error in errors:
+    stderr.write("Skipped task {0}: {1}\n".format(task_id, error))
+stderr.write("Exported {0} unique IOCs from {1} tasks\n".format(written, len(task_ids) - len(errors)))
+if output is not stdout:
+    output.close()
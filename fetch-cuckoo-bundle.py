@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Downloads reports, pcaps, screenshots, and other artifacts of many Cuckoo tasks into a directory or archive"""
+
+from argparse import ArgumentParser
+from atexit import register
+from sys import stderr
+
+from cuckoocli import get_cuckoo
+from cuckooutils import bundle_artifacts
+
+__version__ = "1.0.0"
+__license__ = """Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+cuckoo = get_cuckoo()
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("-v", "--version", action="version", version=__version__)
+parser.add_argument("task_id", nargs="+", type=int, help="One or more task IDs")
+parser.add_argument("--artifacts", default="report,pcap,screenshot,dropped",
+                    help="Comma separated artifacts to download, from {0}. "
+                         "Default: report,pcap,screenshot,dropped".format(", ".join(sorted(bundle_artifacts))))
+parser.add_argument("--output", default=".",
+                    help="The directory to save a subdirectory for each task in, or with --format, the archive to "
+                         "add artifacts to. Default: the current directory")
+parser.add_argument("--format", choices=("tar", "zip"),
+                    help="Add artifacts to a single archive instead of a directory")
+parser.add_argument("--verify", action="store_true",
+                    help="Check the hashes of artifacts that have already been downloaded, instead of only their "
+                         "sizes")
+parser.add_argument("--workers", type=int, default=8,
+                    help="The number of artifacts to download at once. Default: 8")
+parser.add_argument("--stats", action="store_true",
+                    help="Print statistics about the requests made to Cuckoo on exit")
+
+args = parser.parse_args()
+
+if args.stats:
+    stats = cuckoo.enable_stats()
+    register(lambda: stderr.write(stats.summary()))
+
+if args.format and args.output == ".":
+    parser.error("--output must be the path of an archive when --format is used")
+
+artifacts = [artifact.strip() for artifact in args.artifacts.split(",") if artifact.strip()]
+for artifact in artifacts:
+    if artifact not in bundle_artifacts:
+        parser.error("Invalid artifact {0}".format(artifact))
+
+
+def print_result(result):
+    if result.get("skipped"):
+        print("Skipped {0}, which has already been downloaded".format(result["path"]))
+    elif "error" in result:
+        stderr.write("Failed to download the {0} of task {1}: {2}\n".format(result["artifact"], result["task_id"],
+                                                                           result["error"]))
+    else:
+        print("Downloaded {0} ({1:.1f} MB) in {2:.1f} seconds at {3:.2f} MB/s".format(
+            result["path"], result["size"] / 1048576.0, result["seconds"], result["rate"] / 1048576.0))
+
+
+results = cuckoo.fetch_task_bundle(args.task_id, artifacts=artifacts, dest=args.output, archive_format=args.format,
+                                   max_workers=args.workers, verify=args.verify, callback=print_result)
+downloaded = [result for result in results if not result.get("skipped") and "error" not in result]
+total_size = sum(result["size"] for result in downloaded)
+stderr.write("Downloaded {0} artifacts ({1:.1f} MB), skipped {2}, failed {3}\n".format(
+    len(downloaded), total_size / 1048576.0, len([result for result in results if result.get("skipped")]),
+    len([result for result in results if "error" in result])))
@@ -84,11 +84,32 @@ setup(
 
     # Alternatively, if you want to distribute just a my_module.py, uncomment
     # this:
-    py_modules=["cuckoo"],
+    py_modules=["cuckooutils", "asynccuckooutils", "cuckoocli"],
+
+    scripts=["submit-to-cuckoo.py", "tor-to-cuckoo.py", "wildfire-to-cuckoo.py", "watch-folder-to-cuckoo.py",
+             "export-cuckoo-iocs.py", "fetch-cuckoo-bundle.py"],
+
+    # To provide executable scripts, use entry points in preference to the
+    # "scripts" keyword. Entry points provide cross-platform support and allow
+    # pip to create the appropriate form of executable for the target platform.
+    entry_points={
+        'console_scripts': [
+            'cuckoo-utils=cuckoocli:main',
+        ],
+    },
 
     # List run-time dependencies here.  These will be installed by pip when
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['requests'],
+    install_requires=['requests', 'futures; python_version < "3"'],
+
+    # List additional groups of dependencies here (e.g. development
+    # dependencies). You can install these using the following syntax,
+    # for example:
+    # $ pip install -e .[async]
+    extras_require={
+        'async': ['aiohttp'],
+        'streaming': ['ijson'],
+    },
 )
@@ -5,14 +5,20 @@
 
 from builtins import input
 from argparse import ArgumentParser
+from sys import stderr
+from atexit import register
 from distutils.util import strtobool
-from io import BytesIO
-from time import sleep
+from tempfile import SpooledTemporaryFile
 from glob import glob
 from zipfile import ZipFile
-from os.path import basename
+from os.path import basename, getsize
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from cuckooutils import Cuckoo, get_file_hash
+from requests.exceptions import RequestException
+
+from cuckoocli import get_cuckoo
+from cuckooutils import TaskTracker, get_file_hash, hash_files
 
 __version__ = "1.0.0"
 __license = """Copyright 2016 Sean Whalen
@@ -29,9 +35,10 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
-cuckoo = Cuckoo("https://cuckoo.example.net", "username", "password")
+cuckoo = get_cuckoo()
 
-parser = ArgumentParser(description=__doc__, version=__version__)
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("-v", "--version", action="version", version=__version__)
 parser.add_argument("sample", nargs="+", help="One or more filenames or globs, or a single URL")
 parser.add_argument("--tags",
                     help="Comma separated tags for selecting an analysis VM",
@@ -43,9 +50,23 @@ parser.add_argument("--tor", action="store_true",
                     help="Enable Tor during analysis")
 parser.add_argument("--procmemdump", action="store_true",
                     help="Dump and analyze process memory")
+parser.add_argument("--parallel", type=int, metavar="N",
+                    help="Submit each file as its own task, using N workers, instead of in a single zip")
+parser.add_argument("--retries", type=int, default=3,
+                    help="Number of times to retry a failed submission in parallel mode. Default: 3")
+parser.add_argument("--resubmit", action="store_true",
+                    help="Submit files that have already been analyzed in parallel mode")
+parser.add_argument("--spool-size", type=int, default=64, metavar="MB",
+                    help="Size a bulk zip can grow to in memory before it is spooled to disk. Default: 64")
+parser.add_argument("--stats", action="store_true",
+                    help="Print statistics about the requests made to Cuckoo on exit")
 
 args = parser.parse_args()
 
+if args.stats:
+    stats = cuckoo.enable_stats()
+    register(lambda: stderr.write(stats.summary()))
+
 options = {}
 
 if args.tor:
@@ -63,7 +84,7 @@ if args.options:
 url = len(args.sample) == 1 and args.sample[0].lower().startswith("http")
 if url:
     url = args.sample[0]
-    results = cuckoo.submit_url(url, tags=args.tags, options=options)
+    task_ids = cuckoo.submit_url(url, tags=args.tags, options=options)
 else:
     filenames = []
 
@@ -77,17 +98,63 @@ else:
     else:
         multi_file = False
 
-    if multi_file:
-        temp_file = BytesIO()
+    if args.parallel:
+        def submit_sample(sample_filename):
+            for attempt in range(args.retries + 1):
+                try:
+                    with open(sample_filename, 'rb') as sample:
+                        return cuckoo.submit_file(basename(sample_filename), sample,
+                                                  tags=args.tags, options=options)
+                except (RequestException, RuntimeError):
+                    if attempt == args.retries:
+                        raise
+                    sleep(2 ** attempt)
+
+        start_time = time()
+        file_hashes = hash_files(filenames, max_workers=args.parallel)
+        existing_tasks = cuckoo.find_tasks_many(set(file_hashes.values()), max_workers=args.parallel)
+        samples = {}
+        for filename in filenames:
+            file_hash = file_hashes[filename]
+            if file_hash in samples:
+                continue
+            if len(existing_tasks[file_hash]) > 0 and not args.resubmit:
+                print("Skipping {0}, which has already been analyzed".format(filename))
+                for task_id in existing_tasks[file_hash]:
+                    print("{0}/analysis/{1}".format(cuckoo.root, task_id))
+                continue
+            samples[file_hash] = filename
+
+        task_ids = []
+        submitted_files = 0
+        submitted_bytes = 0
+        executor = ThreadPoolExecutor(max_workers=args.parallel)
+        futures = dict((executor.submit(submit_sample, filename), filename) for filename in samples.values())
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                task_ids += future.result()
+            except (RequestException, RuntimeError) as e:
+                print("Failed to submit {0}: {1}".format(filename, e))
+                continue
+            submitted_files += 1
+            submitted_bytes += getsize(filename)
+        executor.shutdown()
+
+        elapsed = max(time() - start_time, 0.001)
+        print("Submitted {0} of {1} files in {2:.1f} seconds ({3:.1f} files/s, {4:.2f} MB/s)".format(
+            submitted_files, len(filenames), elapsed, submitted_files / elapsed,
+            submitted_bytes / elapsed / 1048576))
+
+    elif multi_file:
+        temp_file = SpooledTemporaryFile(max_size=args.spool_size * 1048576)
         temp_filename = "bulk.zip"
-        with ZipFile(temp_file, 'a') as temp_zip:
-            temp_zip.setpassword("infected")
+        with ZipFile(temp_file, 'w') as temp_zip:
             for filename in filenames:
                 temp_zip.write(filename)
     else:
         temp_filename = basename(filenames[0])
-        with open(temp_filename, 'rb') as sample_file:
-            temp_file = BytesIO(sample_file.read())
+        temp_file = open(filenames[0], 'rb')
         file_hash = get_file_hash(temp_file)
         existing_tasks = cuckoo.find_tasks(file_hash)
         if len(existing_tasks) > 0:
@@ -101,23 +168,16 @@ else:
             if not resubmit:
                 exit()
 
-    results = cuckoo.submit_file(temp_filename, temp_file.getvalue(), tags=args.tags, options=options)
+    if not args.parallel:
+        temp_file.seek(0)
+        task_ids = cuckoo.submit_file(temp_filename, temp_file, tags=args.tags, options=options)
+        temp_file.close()
 
-tasks = {}
 
-task_ids = results['task_ids']
+def print_state(task_id, previous_state, current_state):
+    print("Task {0} is {1}".format(task_id, current_state))
+    if current_state == "reported":
+        print("{0}/analysis/{1}".format(cuckoo.root, task_id))
 
-for task_id in task_ids:
-    tasks[task_id] = dict(previous_state=None, current_state=None)
 
-while (len(tasks)) > 0:
-    for task_id in tasks.keys():
-        tasks[task_id]['previous_state'] = tasks[task_id]['current_state']
-        tasks[task_id]['current_state'] = cuckoo.get_task_status(task_id)
-        if tasks[task_id]['current_state'] != tasks[task_id]['previous_state']:
-            print("Task {0} is {1}".format(task_id,  tasks[task_id]['current_state']))
-        if tasks[task_id]['current_state'] == "reported":
-            print("{0}/analysis/{1}".format(cuckoo.root, task_id))
-        if tasks[task_id]['current_state'] == "reported" or tasks[task_id]['current_state'].startswith("failed"):
-            del tasks[task_id]
-        sleep(1)
\ No newline at end of file
+TaskTracker(cuckoo, task_ids, callbacks=[print_state]).run()
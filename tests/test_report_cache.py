@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for ReportCache"""
+
+import shutil
+import tempfile
+import unittest
+
+from cuckooutils import ReportCache
+
+
+class ReportCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reports_are_keyed_by_server(self):
+        cache = ReportCache(self.directory)
+        cache.set(1, "json", dict(server="a"), server="https://a.example/api")
+        cache.set(1, "json", dict(server="b"), server="https://b.example/api")
+        self.assertEqual(cache.get(1, "json", server="https://a.example/api"), dict(server="a"))
+        self.assertEqual(cache.get(1, "json", server="https://b.example/api"), dict(server="b"))
+        self.assertIsNone(cache.get(1, "json", server="https://c.example/api"))
+        self.assertIsNone(cache.get(1, "json"))
+
+    def test_corrupt_report_is_a_miss(self):
+        cache = ReportCache(self.directory)
+        cache.set(1, "json", dict(task=1), server="https://a.example/api")
+        file_path = cache._path(1, "json", "https://a.example/api")
+        with open(file_path, "wb") as cache_file:
+            cache_file.write(b"corrupt")
+        self.assertIsNone(cache.get(1, "json", server="https://a.example/api"))
+
+
+if __name__ == "__main__":
+    unittest.main()
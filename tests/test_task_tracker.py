@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for TaskTracker"""
+
+import unittest
+
+import cuckooutils
+from cuckooutils import Cuckoo, TaskTracker
+
+
+class FakeCuckoo(Cuckoo):
+    """Lists tasks by completion time like the API, so unfinished tasks sort last, and counts requests"""
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.requests = 0
+
+    def get_task_statuses(self, limit=None, offset=None, window=None):
+        self.requests += 1
+        ordered = sorted(self.tasks, key=lambda task_id: (self.tasks[task_id] != "reported", -task_id))
+        return dict((task_id, self.tasks[task_id]) for task_id in ordered[offset or 0:(offset or 0) + limit])
+
+    def get_task_status(self, task_id):
+        self.requests += 1
+        return self.tasks[task_id]
+
+
+class TaskTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.time = cuckooutils.time
+        self.now = 0
+        cuckooutils.time = lambda: self.now
+
+    def tearDown(self):
+        cuckooutils.time = self.time
+
+    def test_page_of_due_tasks(self):
+        tasks = dict((task_id, "reported") for task_id in range(1, 11))
+        cuckoo = FakeCuckoo(tasks)
+        tracker = TaskTracker(cuckoo, task_ids=range(1, 11), batch_size=10)
+        changes = tracker.poll()
+        self.assertEqual(len(changes), 10)
+        self.assertEqual(cuckoo.requests, 1)
+        self.assertEqual(tracker.tasks, {})
+
+    def test_unfinished_tasks_off_the_page(self):
+        # The tracked tasks are still running, so the newest page only holds other, already reported tasks
+        tasks = dict((task_id, "reported") for task_id in range(1, 201))
+        for task_id in range(201, 206):
+            tasks[task_id] = "running"
+        cuckoo = FakeCuckoo(tasks)
+        tracker = TaskTracker(cuckoo, task_ids=range(201, 206), batch_size=100, batch_retry=3)
+        tracker.poll()
+        self.assertEqual(cuckoo.requests, 1 + 5)
+        for _ in range(3):
+            self.now += 5
+            cuckoo.requests = 0
+            tracker.poll()
+            self.assertEqual(cuckoo.requests, 5)
+        self.now += 5
+        cuckoo.requests = 0
+        tracker.poll()
+        self.assertEqual(cuckoo.requests, 1 + 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for Cuckoo.watch_tasks and its journal"""
+
+import json
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import cuckooutils
+from cuckooutils import Cuckoo
+
+
+class _Stop(Exception):
+    pass
+
+
+class FakeCuckoo(Cuckoo):
+    """Lists tasks newest first, like the API, without a server"""
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+
+    def list_tasks(self, limit=None, offset=None, window=None, records=False):
+        ordered = sorted(self.tasks, key=lambda task_id: -task_id)
+        return dict(data=[dict(id=task_id, status=self.tasks[task_id])
+                          for task_id in ordered[offset or 0:(offset or 0) + limit]])
+
+
+class WatchTasksTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal_path = path.join(self.directory, "journal.json")
+        self.sleep = cuckooutils.sleep
+
+    def tearDown(self):
+        cuckooutils.sleep = self.sleep
+        shutil.rmtree(self.directory)
+
+    def watch(self, cuckoo, rounds, between_rounds=None, **kwargs):
+        """Runs watch_tasks for a number of rounds, and returns the transitions it yielded"""
+        state = dict(rounds=0)
+
+        def sleep(interval):
+            state["rounds"] += 1
+            if state["rounds"] >= rounds:
+                raise _Stop()
+            if between_rounds is not None:
+                between_rounds(state["rounds"])
+
+        cuckooutils.sleep = sleep
+        transitions = []
+        try:
+            for transition in cuckoo.watch_tasks(journal_path=self.journal_path, interval=0, **kwargs):
+                transitions.append(transition)
+        except _Stop:
+            pass
+        return transitions
+
+    def load_journal(self):
+        with open(self.journal_path) as journal_file:
+            return json.load(journal_file)
+
+    def test_deleted_task_beyond_listed_pages(self):
+        # More tasks than max_pages pages cover, with one deleted ID among them
+        tasks = dict((task_id, "reported") for task_id in range(1, 30001) if task_id != 25001)
+        cuckoo = FakeCuckoo(tasks)
+
+        def add_task(round_number):
+            tasks[30000 + round_number] = "reported"
+
+        self.watch(cuckoo, 4, between_rounds=add_task, page_size=1000, max_pages=10)
+        journal = self.load_journal()
+        self.assertEqual(journal["since_task_id"], 30003)
+        self.assertEqual(journal["states"], {})
+        self.assertEqual(journal["finished"], [])
+
+    def test_finished_tasks_are_not_kept(self):
+        tasks = {1: "reported", 2: "running", 3: "reported", 4: "pending"}
+        cuckoo = FakeCuckoo(tasks)
+
+        def progress(round_number):
+            if round_number == 1:
+                tasks[2] = "reported"
+            elif round_number == 2:
+                tasks[4] = "running"
+
+        transitions = self.watch(cuckoo, 3, between_rounds=progress, page_size=10)
+        self.assertEqual(transitions, [(1, None, "reported"), (2, None, "running"), (3, None, "reported"),
+                                       (4, None, "pending"), (2, "running", "reported"), (4, "pending", "running")])
+        journal = self.load_journal()
+        self.assertEqual(journal["since_task_id"], 3)
+        self.assertEqual(journal["states"], {"4": "running"})
+        self.assertEqual(journal["finished"], [])
+
+    def test_unlisted_unfinished_task_is_forgotten(self):
+        tasks = dict((task_id, "reported") for task_id in range(1, 21))
+        tasks[15] = "running"
+        cuckoo = FakeCuckoo(tasks)
+
+        def delete_task(round_number):
+            if round_number == 1:
+                del tasks[15]
+
+        # Only the ten newest tasks are listed, so the deleted task cannot be told apart from an unlisted one until
+        # it has been missing for forget_after rounds
+        self.watch(cuckoo, 2, between_rounds=delete_task, page_size=10, max_pages=1, forget_after=2)
+        self.assertEqual(self.load_journal()["since_task_id"], 14)
+        self.watch(cuckoo, 2, page_size=10, max_pages=1, forget_after=2)
+        journal = self.load_journal()
+        self.assertEqual(journal["since_task_id"], 20)
+        self.assertEqual(journal["states"], {})
+
+    def test_resume_from_journal(self):
+        tasks = {1: "reported", 2: "running"}
+        self.watch(FakeCuckoo(tasks), 1, page_size=10)
+        tasks[2] = "reported"
+        transitions = self.watch(FakeCuckoo(tasks), 1, page_size=10)
+        self.assertEqual(transitions, [(2, "running", "reported")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,13 +4,24 @@
 """Downloads a file via Tor, through a privoxy chain, and sends it to Cuckoo"""
 from builtins import input
 from argparse import ArgumentParser
+from sys import stderr
+from atexit import register
 from distutils.util import strtobool
-from io import BytesIO
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import sha256
+from os import remove
+from os.path import basename
+from shutil import rmtree
+from tempfile import NamedTemporaryFile, mkdtemp
+from time import time
+from uuid import uuid4
 
 from requests import get
+from requests.compat import urlparse
+from requests.exceptions import RequestException
 
-from cuckooutils import Cuckoo, get_file_hash
+from cuckoocli import get_cuckoo
+from cuckooutils import TaskTracker
 
 __version__ = "1.0.0"
 __license__ = """Copyright 2016 Sean Whalen
@@ -27,12 +38,15 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
-cuckoo = Cuckoo("https://cuckoo.example.net", "username", "password")
+cuckoo = get_cuckoo()
 default_user_agent = "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/4.0; InfoPath.2; " \
                      ".NET CLR 2.0.50727; WOW64)"
 
-parser = ArgumentParser(description=__doc__, version=__version__)
-parser.add_argument("URL", help="URL of the sample")
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("-v", "--version", action="version", version=__version__)
+parser.add_argument("URL", nargs="?", help="URL of the sample")
+parser.add_argument("--url-list", metavar="FILE",
+                    help="Download and submit every URL in FILE, one per line, instead of a single URL")
 parser.add_argument("--tags",
                     help="Comma separated tags for selecting an analysis VM",
                     default=None)
@@ -45,9 +59,26 @@ parser.add_argument("--procmemdump", action="store_true",
                     help="Dump and analyze process memory")
 parser.add_argument("--user-agent", help="The user agent to spoof. Default: {0}".format(default_user_agent),
                     default=default_user_agent)
+parser.add_argument("--workers", type=int, default=8,
+                    help="Number of URLs to download at once from a URL list. Default: 8")
+parser.add_argument("--socks", metavar="HOST:PORT",
+                    help="Download directly through the Tor SOCKS port instead of privoxy, using a separate "
+                         "Tor circuit for each URL. Requires requests[socks]")
+parser.add_argument("--max-size", type=float, default=100, metavar="MB",
+                    help="Abandon downloads larger than this. Default: 100")
+parser.add_argument("--timeout", type=float, default=300, metavar="SECONDS",
+                    help="Abandon downloads that take longer than this. Default: 300")
+parser.add_argument("--resubmit", action="store_true",
+                    help="Submit samples from a URL list that have already been analyzed")
+parser.add_argument("--stats", action="store_true",
+                    help="Print statistics about the requests made to Cuckoo on exit")
 
 args = parser.parse_args()
 
+if args.stats:
+    stats = cuckoo.enable_stats()
+    register(lambda: stderr.write(stats.summary()))
+
 options = {}
 
 if args.tor:
@@ -62,50 +93,123 @@ if args.options:
         options += ","
     options += args.options
 
-proxies = {"http": "http://localhost:8118",
-           "https": "http://localhost:8118"}
-
 headers = {"user-agent": args.user_agent}
 
-options = ""
-if args.tor:
-    options += "tor=yes"
-if not args.URL.lower().startswith("http"):
-    args.URL = "http://{0}".format(args.URL)
-filename = args.URL.split("/")[-1]
-response = get(args.URL, headers=headers, proxies=proxies)
-response.raise_for_status()
-temp_file = BytesIO(response.content)
-file_hash = get_file_hash(temp_file)
-existing_tasks = cuckoo.find_tasks(file_hash)
-if len(existing_tasks) > 0:
-    print("The following analysis reports already exist for this sample:")
-    for task_id in existing_tasks:
-        print("{0}/analysis/{1}".format(cuckoo.root, task_id))
+
+def get_proxies():
+    if args.socks:
+        # Tor isolates streams with different SOCKS credentials onto different circuits
+        proxy = "socks5h://{0}:{1}@{2}".format(uuid4().hex, uuid4().hex, args.socks)
+    else:
+        proxy = "http://localhost:8118"
+    return {"http": proxy, "https": proxy}
+
+
+def download(url, directory=None):
+    """Streams a URL to a temporary file while hashing it, and returns the file path, SHA256 hash, and size"""
+    start_time = time()
+    max_size = args.max_size * 1048576
+    response = get(url, headers=headers, proxies=get_proxies(), stream=True, timeout=args.timeout)
+    try:
+        response.raise_for_status()
+        hasher = sha256()
+        size = 0
+        with NamedTemporaryFile(dir=directory, delete=False) as temp_file:
+            try:
+                for chunk in response.iter_content(chunk_size=65536):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise ValueError("{0} is larger than {1} MB".format(url, args.max_size))
+                    if time() - start_time > args.timeout:
+                        raise ValueError("{0} took longer than {1} seconds to download".format(url, args.timeout))
+                    hasher.update(chunk)
+                    temp_file.write(chunk)
+            except (RequestException, ValueError):
+                temp_file.close()
+                remove(temp_file.name)
+                raise
+    finally:
+        response.close()
+
+    return temp_file.name, hasher.hexdigest(), size
+
+
+def get_filename(url):
+    return basename(urlparse(url).path) or "sample"
+
+
+def normalize_url(url):
+    if not url.lower().startswith("http"):
+        url = "http://{0}".format(url)
+    return url
+
+
+if args.url_list:
+    with open(args.url_list) as url_list:
+        urls = [normalize_url(line.strip()) for line in url_list if line.strip()]
+    temp_directory = mkdtemp()
+    samples = {}
+    task_ids = []
+    try:
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+        futures = dict((executor.submit(download, url, temp_directory), url) for url in urls)
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                temp_path, file_hash, size = future.result()
+            except (RequestException, ValueError) as e:
+                stderr.write("Failed to download {0}: {1}\n".format(url, e))
+                continue
+            if file_hash in samples:
+                print("{0} is identical to {1}".format(url, samples[file_hash][0]))
+                remove(temp_path)
+                continue
+            samples[file_hash] = (url, temp_path)
+        executor.shutdown()
+
+        existing_tasks = cuckoo.find_tasks_many(samples.keys(), max_workers=args.workers)
+        for file_hash in samples:
+            url, temp_path = samples[file_hash]
+            if len(existing_tasks[file_hash]) > 0 and not args.resubmit:
+                print("{0} has already been analyzed: {1}/analysis/{2}".format(url, cuckoo.root,
+                                                                               existing_tasks[file_hash][-1]))
+                continue
+            try:
+                with open(temp_path, "rb") as sample_file:
+                    task_ids += cuckoo.submit_file(get_filename(url), sample_file, tags=args.tags, options=options)
+            except (RequestException, RuntimeError) as e:
+                # Keep going, so one failure does not lose the rest of the downloaded samples
+                stderr.write("Failed to submit {0} to Cuckoo: {1}\n".format(url, e))
+    finally:
+        rmtree(temp_directory)
+else:
+    if args.URL is None:
+        parser.error("A URL or --url-list is required")
+    url = normalize_url(args.URL)
+    temp_path, file_hash, size = download(url)
     try:
-        resubmit = strtobool(input("Would you like to resubmit it? (y/N)").lower())
-    except ValueError:
-        exit()
-    if not resubmit:
-        exit()
-
-results = cuckoo.submit_file(filename, temp_file.getvalue(), tags=args.tags, options=options)
-
-tasks = {}
-
-task_ids = results['task_ids']
-
-for task_id in task_ids:
-    tasks[task_id] = dict(previous_state=None, current_state=None)
-
-while (len(tasks)) > 0:
-    for task_id in tasks.keys():
-        tasks[task_id]['previous_state'] = tasks[task_id]['current_state']
-        tasks[task_id]['current_state'] = cuckoo.get_task_status(task_id)
-        if tasks[task_id]['current_state'] != tasks[task_id]['previous_state']:
-            print("Task {0} is {1}".format(task_id,  tasks[task_id]['current_state']))
-        if tasks[task_id]['current_state'] == "reported":
-            print("{0}/analysis/{1}".format(cuckoo.root, task_id))
-        if tasks[task_id]['current_state'] == "reported" or tasks[task_id]['current_state'].startswith("failed"):
-            del tasks[task_id]
-        sleep(1)
\ No newline at end of file
+        existing_tasks = cuckoo.find_tasks(file_hash)
+        if len(existing_tasks) > 0:
+            print("The following analysis reports already exist for this sample:")
+            for task_id in existing_tasks:
+                print("{0}/analysis/{1}".format(cuckoo.root, task_id))
+            try:
+                resubmit = strtobool(input("Would you like to resubmit it? (y/N)").lower())
+            except ValueError:
+                exit()
+            if not resubmit:
+                exit()
+
+        with open(temp_path, "rb") as sample_file:
+            task_ids = cuckoo.submit_file(get_filename(url), sample_file, tags=args.tags, options=options)
+    finally:
+        remove(temp_path)
+
+
+def print_state(task_id, previous_state, current_state):
+    print("Task {0} is {1}".format(task_id, current_state))
+    if current_state == "reported":
+        print("{0}/analysis/{1}".format(cuckoo.root, task_id))
+
+
+TaskTracker(cuckoo, task_ids, callbacks=[print_state]).run()
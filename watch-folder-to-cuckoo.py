@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Watches directories, and submits new files to Cuckoo as they arrive. Uses inotify_simple where available -
+https://pypi.python.org/pypi/inotify_simple/"""
+
+from argparse import ArgumentParser
+from atexit import register
+from os import listdir, stat
+from os.path import basename, isfile, join
+from sys import stderr
+from threading import Lock, Thread
+from time import sleep, time
+
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+from requests.exceptions import RequestException
+
+from cuckoocli import get_cuckoo
+from cuckooutils import KnownSampleIndex, get_file_hash
+
+__version__ = "1.0.0"
+__license__ = """Copyright 2016 Sean Whalen
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+cuckoo = get_cuckoo()
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("-v", "--version", action="version", version=__version__)
+parser.add_argument("directory", nargs="+", help="One or more directories to watch")
+parser.add_argument("--state", default="watch-folder-to-cuckoo.db",
+                    help="A SQLite database of files that have already been submitted. "
+                         "Default: watch-folder-to-cuckoo.db")
+parser.add_argument("--tags",
+                    help="Comma separated tags for selecting an analysis VM",
+                    default=None)
+parser.add_argument("--options",
+                    help="Comma separated option=value pairs",
+                    default=None)
+parser.add_argument("--workers", type=int, default=4,
+                    help="Number of files to hash and submit at once. Default: 4")
+parser.add_argument("--queue-size", type=int, default=100,
+                    help="Number of files that can wait to be submitted before new files are left for a later scan. "
+                         "Default: 100")
+parser.add_argument("--max-pending", type=int, default=50,
+                    help="Pause submissions while Cuckoo has this many pending tasks. Default: 50")
+parser.add_argument("--scan-interval", type=float, default=10,
+                    help="Seconds between directory scans, when inotify is not available. Default: 10")
+parser.add_argument("--rescan-interval", type=float, default=300,
+                    help="Seconds between directory scans when inotify is available, which pick up files whose "
+                         "events were missed. Default: 300")
+parser.add_argument("--settle-time", type=float, default=5,
+                    help="Seconds a file must be unmodified before it is submitted, when scanning. Default: 5")
+parser.add_argument("--resubmit", action="store_true",
+                    help="Submit files that have already been analyzed")
+parser.add_argument("--stats", action="store_true",
+                    help="Print statistics about the requests made to Cuckoo on exit")
+
+args = parser.parse_args()
+
+if args.stats:
+    stats = cuckoo.enable_stats()
+    register(lambda: stderr.write(stats.summary()))
+
+index = KnownSampleIndex(args.state)
+# Both tables live in the same database, so share the index's connection and lock instead of opening another
+state_lock = index.lock
+state = index.connection
+with state:
+    state.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                  "sha256 TEXT, task_ids TEXT)")
+
+queue = Queue(maxsize=args.queue_size)
+queued = set()
+queued_lock = Lock()
+status_lock = Lock()
+cuckoo_status = dict(pending=0, updated=0)
+
+
+def is_known(file_path, file_stat):
+    with state_lock:
+        row = state.execute("SELECT size, mtime FROM files WHERE path = ?", (file_path,)).fetchone()
+    return row is not None and row[0] == file_stat.st_size and row[1] == file_stat.st_mtime
+
+
+def record(file_path, file_stat, file_hash, task_ids):
+    with state_lock, state:
+        state.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                      (file_path, file_stat.st_size, file_stat.st_mtime, file_hash,
+                       ",".join(str(task_id) for task_id in task_ids)))
+
+
+def enqueue(file_path, block=True):
+    """Queues a file to be submitted, and returns False if block is False and the queue is full"""
+    with queued_lock:
+        if file_path in queued:
+            return True
+        queued.add(file_path)
+    # Blocking while the queue is full stops new files being picked up until Cuckoo catches up
+    try:
+        queue.put(file_path, block=block)
+    except Full:
+        with queued_lock:
+            queued.discard(file_path)
+        return False
+    return True
+
+
+def wait_for_capacity():
+    while True:
+        with status_lock:
+            if time() - cuckoo_status["updated"] > 5:
+                try:
+                    cuckoo_status["pending"] = cuckoo.get_cuckoo_status()["tasks"]["pending"]
+                    cuckoo_status["updated"] = time()
+                except (RequestException, RuntimeError, KeyError) as e:
+                    stderr.write("Unable to get the Cuckoo status: {0}\n".format(e))
+            if cuckoo_status["pending"] < args.max_pending:
+                # Count this submission, so workers do not all submit at once before the next status update
+                cuckoo_status["pending"] += 1
+                return
+        sleep(5)
+
+
+def process(file_path):
+    try:
+        file_stat = stat(file_path)
+    except OSError:
+        return
+    if is_known(file_path, file_stat):
+        return
+    with open(file_path, "rb") as sample_file:
+        file_hash = get_file_hash(sample_file)
+        existing_tasks = cuckoo.find_tasks_many([file_hash], index=index)[file_hash]
+        if len(existing_tasks) > 0 and not args.resubmit:
+            print("{0} has already been analyzed: {1}/analysis/{2}".format(file_path, cuckoo.root,
+                                                                           existing_tasks[-1]))
+            record(file_path, file_stat, file_hash, existing_tasks)
+            return
+        wait_for_capacity()
+        task_ids = cuckoo.submit_file(basename(file_path), sample_file, tags=args.tags, options=args.options)
+    index.add(file_hash, existing_tasks + task_ids)
+    record(file_path, file_stat, file_hash, task_ids)
+    print("Submitted {0} as task {1}".format(file_path, ", ".join(str(task_id) for task_id in task_ids)))
+
+
+def worker():
+    while True:
+        file_path = queue.get()
+        try:
+            process(file_path)
+        except Exception as e:
+            # Anything else would kill the worker thread, and with it, a share of the daemon's throughput
+            stderr.write("Failed to submit {0}: {1}\n".format(file_path, e))
+        finally:
+            with queued_lock:
+                queued.discard(file_path)
+            queue.task_done()
+
+
+def scan(settle_time, block=True):
+    """Queues new files, and returns False if block is False and the queue filled up before the scan finished"""
+    now = time()
+    for directory in args.directory:
+        for file_name in listdir(directory):
+            file_path = join(directory, file_name)
+            if not isfile(file_path):
+                continue
+            try:
+                file_stat = stat(file_path)
+            except OSError:
+                continue
+            if now - file_stat.st_mtime >= settle_time and not is_known(file_path, file_stat):
+                if not enqueue(file_path, block=block):
+                    return False
+    return True
+
+
+for i in range(args.workers):
+    thread = Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+
+# Pick up anything that arrived while the daemon was not running
+scan(0)
+
+try:
+    if INotify is not None:
+        inotify = INotify()
+        watches = {}
+        for directory in args.directory:
+            watches[inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)] = directory
+        # Events are read while workers are busy, so a full queue never makes the kernel drop them. Files that
+        # could not be queued, or whose events were dropped anyway, are picked up by the next scan.
+        missed = False
+        last_scan = time()
+        while True:
+            for event in inotify.read(timeout=int(args.scan_interval * 1000)):
+                if event.mask & flags.Q_OVERFLOW:
+                    missed = True
+                    continue
+                file_path = join(watches[event.wd], event.name)
+                if isfile(file_path) and not enqueue(file_path, block=False):
+                    missed = True
+            if (missed or time() - last_scan >= args.rescan_interval) and not queue.full():
+                missed = not scan(args.settle_time, block=False)
+                last_scan = time()
+    else:
+        while True:
+            sleep(args.scan_interval)
+            scan(args.settle_time)
+except KeyboardInterrupt:
+    pass
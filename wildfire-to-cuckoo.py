@@ -6,12 +6,23 @@ Cuckoo. Requires pyldfire - https://github.com/seanthegeek/pyldfire"""
 
 from builtins import input
 from argparse import ArgumentParser
-from io import BytesIO
+from sys import stderr
+from atexit import register
 from distutils.util import strtobool
-from time import sleep
+from threading import Thread
+import json
+import sys
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from requests.exceptions import RequestException
 
 from pyldfire import WildFire
-from cuckooutils import Cuckoo
+from cuckoocli import get_cuckoo, load_config
+from cuckooutils import TaskTracker, TokenBucket, classify_hashes
 
 __version__ = "1.0.1"
 __license__ = """Copyright 2016 Sean Whalen
@@ -28,11 +39,12 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
-wildfire = WildFire("api-key-goes-here")
-cuckoo = Cuckoo("https://cuckoo.example.net/", "username", "password")
+wildfire = WildFire(load_config()["wildfire_api_key"])
+cuckoo = get_cuckoo()
 
-parser = ArgumentParser(description=__doc__, version=__version__)
-parser.add_argument("hash", help="A MD5, SHA1, or SHA256 hash of a sample")
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("-v", "--version", action="version", version=__version__)
+parser.add_argument("hash", nargs="?", help="A MD5, SHA1, or SHA256 hash of a sample")
 parser.add_argument("filename", nargs="?", help="The filename of the sample")
 parser.add_argument("--tags",
                     help="Comma separated tags for selecting an analysis VM",
@@ -44,8 +56,25 @@ parser.add_argument("--tor", action="store_true",
                      help="Enable Tor during analysis")
 parser.add_argument("--procmemdump", action="store_true",
                     help="Dump and analyze process memory")
+parser.add_argument("--hash-list", metavar="FILE",
+                    help="Transfer every hash in FILE, one per line, instead of a single hash. Use - for standard input")
+parser.add_argument("--progress", default="wildfire-to-cuckoo.log", metavar="FILE",
+                    help="A log of hashes that have been transferred from a hash list, so an interrupted transfer can be "
+                         "resumed. Default: wildfire-to-cuckoo.log")
+parser.add_argument("--workers", type=int, default=4,
+                    help="Number of samples to download from Wildfire at once. Default: 4")
+parser.add_argument("--rate", type=float, default=60,
+                    help="Maximum number of Wildfire downloads per minute. Default: 60")
+parser.add_argument("--resubmit", action="store_true",
+                    help="Submit samples from a hash list that have already been analyzed")
+parser.add_argument("--stats", action="store_true",
+                    help="Print statistics about the requests made to Cuckoo on exit")
 args = parser.parse_args()
 
+if args.stats:
+    stats = cuckoo.enable_stats()
+    register(lambda: stderr.write(stats.summary()))
+
 options = {}
 
 if args.tor:
@@ -60,36 +89,126 @@ if args.options:
         options += ","
     options += args.options
 
-existing_tasks = cuckoo.find_tasks(args.hash)
-if len(existing_tasks) > 0:
-    print("The following analysis reports already exist for this sample:")
-    for task_id in existing_tasks:
-        print("{0}/analysis/{1}".format(cuckoo.root, task_id))
+
+def load_progress(progress_path):
+    """Returns a dict of hash to the outcome of every hash in the progress log that does not need to be retried"""
+    progress = {}
     try:
-        resubmit = strtobool(input("Would you like to resubmit it? (/y/N)").lower())
-    except ValueError:
-        exit()
-    if not resubmit:
-        exit()
-
-temp_file = BytesIO(wildfire.get_sample(args.hash))
-results = cuckoo.submit_file((args.filename or args.hash),
-                             temp_file.getvalue(),
-                             tags=args.tags,
-                             options=",".join(options))
-tasks = {}
-
-for task_id in results:
-    tasks[task_id] = dict(previous_state=None, current_state=None)
-
-while (len(tasks)) > 0:
-    for task_id in tasks.keys():
-        tasks[task_id]['previous_state'] = tasks[task_id]['current_state']
-        tasks[task_id]['current_state'] = cuckoo.get_task_status(task_id)
-        if tasks[task_id]['current_state'] != tasks[task_id]['previous_state']:
-            print("Task {0} is {1}".format(task_id,  tasks[task_id]['current_state']))
-        if tasks[task_id]['current_state'] == "reported":
+        with open(progress_path) as progress_file:
+            for line in progress_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A partial line from an interrupted run
+                    continue
+                if entry["status"] == "error":
+                    progress.pop(entry["hash"], None)
+                else:
+                    progress[entry["hash"]] = entry
+    except IOError:
+        pass
+    return progress
+
+
+def downloader(sample_hashes, bucket, samples):
+    while True:
+        sample_hash = sample_hashes.get()
+        bucket.acquire()
+        try:
+            samples.put((sample_hash, wildfire.get_sample(sample_hash), None))
+        except Exception as e:
+            samples.put((sample_hash, None, e))
+
+
+if args.hash_list:
+    if args.hash_list == "-":
+        hashes = classify_hashes(sys.stdin)
+    else:
+        with open(args.hash_list) as hash_list:
+            hashes = classify_hashes(hash_list)
+    for invalid_hash in hashes.pop("invalid"):
+        if len(invalid_hash) > 0:
+            stderr.write("Skipping invalid hash {0}\n".format(invalid_hash))
+    progress = load_progress(args.progress)
+    sample_hashes = []
+    for hash_type in hashes:
+        for sample_hash in hashes[hash_type]:
+            sample_hash = sample_hash.lower()
+            if sample_hash not in progress and sample_hash not in sample_hashes:
+                sample_hashes.append(sample_hash)
+
+    task_ids = []
+    with open(args.progress, "a") as progress_log:
+        def log_progress(sample_hash, status, sample_task_ids=None, error=None):
+            entry = dict(hash=sample_hash, status=status, task_ids=sample_task_ids or [])
+            if error is not None:
+                entry["error"] = str(error)
+            progress_log.write("{0}\n".format(json.dumps(entry)))
+            progress_log.flush()
+
+        existing_tasks = cuckoo.find_tasks_many(sample_hashes)
+        missing = []
+        for sample_hash in sample_hashes:
+            if len(existing_tasks[sample_hash]) > 0 and not args.resubmit:
+                print("{0} has already been analyzed: {1}/analysis/{2}".format(sample_hash, cuckoo.root,
+                                                                               existing_tasks[sample_hash][-1]))
+                log_progress(sample_hash, "exists", existing_tasks[sample_hash])
+            else:
+                missing.append(sample_hash)
+
+        download_queue = Queue()
+        for sample_hash in missing:
+            download_queue.put(sample_hash)
+        # Downloads wait while this many samples are waiting to be submitted, which bounds memory use
+        samples = Queue(maxsize=args.workers)
+        bucket = TokenBucket(args.rate / 60.0, capacity=args.workers)
+        for i in range(min(args.workers, len(missing))):
+            thread = Thread(target=downloader, args=(download_queue, bucket, samples))
+            thread.daemon = True
+            thread.start()
+
+        # Samples are submitted as they arrive, while the next ones download
+        for i in range(len(missing)):
+            sample_hash, sample, error = samples.get()
+            if error is not None:
+                stderr.write("Failed to download {0} from Wildfire: {1}\n".format(sample_hash, error))
+                log_progress(sample_hash, "error", error=error)
+                continue
+            try:
+                sample_task_ids = cuckoo.submit_file(sample_hash, sample, tags=args.tags, options=options)
+            except (RequestException, RuntimeError) as e:
+                stderr.write("Failed to submit {0} to Cuckoo: {1}\n".format(sample_hash, e))
+                log_progress(sample_hash, "error", error=e)
+                continue
+            print("Submitted {0} as task {1}".format(sample_hash,
+                                                     ", ".join(str(task_id) for task_id in sample_task_ids)))
+            log_progress(sample_hash, "submitted", sample_task_ids)
+            task_ids += sample_task_ids
+else:
+    if args.hash is None:
+        parser.error("A hash or --hash-list is required")
+    existing_tasks = cuckoo.find_tasks(args.hash)
+    if len(existing_tasks) > 0:
+        print("The following analysis reports already exist for this sample:")
+        for task_id in existing_tasks:
             print("{0}/analysis/{1}".format(cuckoo.root, task_id))
-        if tasks[task_id]['current_state'] == "reported" or tasks[task_id]['current_state'].startswith("failed"):
-            del tasks[task_id]
-        sleep(1)
+        try:
+            resubmit = strtobool(input("Would you like to resubmit it? (/y/N)").lower())
+        except ValueError:
+            exit()
+        if not resubmit:
+            exit()
+
+    task_ids = cuckoo.submit_file((args.filename or args.hash),
+                                  wildfire.get_sample(args.hash),
+                                  tags=args.tags,
+                                  options=options)
+
+
+def print_state(task_id, previous_state, current_state):
+    print("Task {0} is {1}".format(task_id, current_state))
+    if current_state == "reported":
+        print("{0}/analysis/{1}".format(cuckoo.root, task_id))
+
+
+TaskTracker(cuckoo, task_ids, callbacks=[print_state]).run()